@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# benchAnalytics.py
+
+"""Benchmark for gameAnalytics.py. Generates a journal of random
+noughts and crosses games, then times loading it and computing each
+statistic. For comparison, the same games are also replayed one by
+one through board.Board, as a pure Python analysis would have to.
+
+  benchAnalytics.py [-n games] [-o journal]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import board
+import gameAnalytics
+import gameJournal
+
+# Games replayed by the pure Python comparison
+PYTHON_SAMPLE = 20000
+
+
+def syntheticGames(n, rng):
+    """Return a GameSet of n games of uniformly random moves, each
+    ending at its first winning move, or in a draw."""
+
+    squares = 9
+    moves = np.argsort(rng.random((n, squares)), axis=1).astype(np.uint8)
+
+    full = gameAnalytics.GameSet(3, 3, 3,
+                                 np.full(n, squares, dtype=np.uint16),
+                                 np.zeros(n, dtype=np.uint8), moves)
+    judged = gameAnalytics.winners(full.plyBoards(),
+                                   gameAnalytics.lineMasks(3, 3, 3))
+
+    won = judged != board.NOBODY
+    last = np.where(won.any(axis=1), won.argmax(axis=1), squares - 1)
+    winner = judged[np.arange(n), last]
+    nmoves = (last + 1).astype(np.uint16)
+    moves[np.arange(squares) >= nmoves[:, None]] = gameJournal.noMove(squares)
+
+    return gameAnalytics.GameSet(3, 3, 3, nmoves, winner, moves)
+
+
+def writeJournal(gs, path):
+    data = np.empty(len(gs), dtype=gameAnalytics.recordDtype(gs.squares))
+    data["nmoves"] = gs.nmoves
+    data["winner"] = gs.winner
+    data["moves"] = gs.moves
+
+    with open(path, "wb") as f:
+        f.write(gameJournal.HEADER.pack(gameJournal.MAGIC, gameJournal.VERSION,
+                                        gs.rows, gs.cols, gs.k))
+        data.tofile(f)
+
+
+def pythonStats(gs, count):
+    """Replay count games with board.Board, collecting the same
+    outcome by first move and length statistics."""
+
+    firsts = {}
+    lengths = {}
+    for g in range(count):
+        b = board.Board(gs.rows, gs.cols, gs.k)
+        w = None
+        for ply in range(int(gs.nmoves[g])):
+            row, col = divmod(int(gs.moves[g, ply]), gs.cols)
+            w = b.place(row, col, board.NOUGHT if ply % 2 == 0 else board.CROSS)
+        first = firsts.setdefault(int(gs.moves[g, 0]), [0, 0, 0])
+        first[w] += 1
+        lengths[len(b.moves)] = lengths.get(len(b.moves), 0) + 1
+    return firsts, lengths
+
+
+def timed(label, n, func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    elapsed = time.perf_counter() - start
+    print("%-24s %8.3f s  %12.0f games/s" % (label, elapsed,
+                                             n / max(elapsed, 1e-9)))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--games", type=int, default=1000000)
+    parser.add_argument("-o", "--output", help="keep the journal here")
+    args = parser.parse_args()
+
+    n = args.games
+    rng = np.random.default_rng(1)
+
+    gs = timed("generate", n, syntheticGames, n, rng)
+
+    path = args.output or os.path.join(tempfile.mkdtemp(),
+                                       gameJournal.journalName(3, 3, 3))
+    timed("write journal", n, writeJournal, gs, path)
+    print("journal: %s, %d bytes" % (path, os.path.getsize(path)))
+
+    gs = timed("load", n, gameAnalytics.GameSet.load, [path])
+    boards = timed("ply boards", n, gs.plyBoards)
+    timed("batch win detection", n, gameAnalytics.winners, boards[:, -1],
+          gameAnalytics.lineMasks(3, 3, 3))
+    bad = timed("check winners", n, gs.checkWinners)
+    timed("first move stats", n, gs.firstMoveStats)
+    timed("openings", n, gs.openings)
+    timed("length distribution", n, gs.lengthDistribution)
+
+    sample = min(n, PYTHON_SAMPLE)
+    timed("pure Python replay", sample, pythonStats, gs, sample)
+
+    if bad:
+        print("%d games judged differently from their recorded winner!" % bad)
+
+    if not args.output:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
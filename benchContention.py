@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+# benchContention.py
+
+"""Contention benchmark for the game server. A number of player
+clients create games and play them to the end with random moves, while
+reader clients repeatedly list the games and read their state. Reports
+throughput and latency percentiles for each operation.
+
+  benchContention.py <GameFactory IOR> [-c clients] [-r readers] [-t secs]
+                     [--json]
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from omniORB import CORBA
+import TicTacToe
+import TicTacToe__POA
+
+# Seconds a bot waits for its go before giving up on the game
+TURN_TIMEOUT = 10
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.errors = 0
+
+    def record(self, op, seconds):
+        with self.lock:
+            self.times.setdefault(op, []).append(seconds)
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        """Return {operation: {count, rate, p50, p99}}, with times in
+        milliseconds."""
+
+        ret = {}
+        for op, times in sorted(self.times.items()):
+            times.sort()
+            ret[op] = {
+                "count": len(times),
+                "rate": len(times) / elapsed,
+                "p50": times[len(times) // 2] * 1000,
+                "p99": times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+            }
+        return ret
+
+    def report(self, elapsed):
+        print("%-12s %9s %9s %9s %9s" % ("operation", "count", "per sec",
+                                         "p50 ms", "p99 ms"))
+        for op, s in self.summary(elapsed).items():
+            print("%-12s %9d %9.1f %9.2f %9.2f" % (op, s["count"], s["rate"],
+                                                   s["p50"], s["p99"]))
+        print("errors:", self.errors)
+
+
+class BotPlayer_i(TicTacToe__POA.Player):
+    """Player that hands each go to the thread driving its game."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.state = None
+        self.over = False
+
+    def yourGo(self, state):
+        self.state = state
+        self.event.set()
+
+    def end(self, state, winner):
+        self.over = True
+        self.event.set()
+
+    def gameAborted(self):
+        self.over = True
+        self.event.set()
+
+
+def timed(stats, op, func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    stats.record(op, time.perf_counter() - start)
+    return ret
+
+
+def playGame(factory, poa, name, stats):
+    game = timed(stats, "newGame", factory.newGame, name)
+
+    bots = [BotPlayer_i(), BotPlayer_i()]
+    ids = [poa.activate_object(bot) for bot in bots]
+    controllers = []
+    try:
+        for id in ids:
+            controller, ptype = timed(stats, "joinGame", game.joinGame,
+                                      poa.id_to_reference(id))
+            controllers.append(controller)
+
+        turn = 0
+        while True:
+            bot = bots[turn]
+            if not bot.event.wait(TURN_TIMEOUT):
+                stats.error()
+                game.kill()
+                break
+            bot.event.clear()
+
+            if bot.over:
+                break
+
+            free = [(x, y) for x in range(3) for y in range(3)
+                    if bot.state[x][y] == TicTacToe.Nobody]
+            x, y = random.choice(free)
+            timed(stats, "play", controllers[turn].play, x, y)
+            turn ^= 1
+
+    finally:
+        for id in ids:
+            poa.deactivate_object(id)
+
+
+def player(factory, poa, prefix, stats, stop):
+    n = 0
+    while not stop.is_set():
+        n += 1
+        try:
+            playGame(factory, poa, "%s-%d" % (prefix, n), stats)
+        except (CORBA.SystemException, TicTacToe.GameFactory.NameInUse,
+                TicTacToe.Game.CannotJoin,
+                TicTacToe.GameController.SquareOccupied,
+                TicTacToe.GameController.NotYourGo) as ex:
+            print("Player error:", ex)
+            stats.error()
+
+
+def reader(factory, stats, stop):
+    while not stop.is_set():
+        try:
+            games, iterator = timed(stats, "listGames", factory.listGames, 100)
+            if iterator is not None:
+                iterator.destroy()
+
+            for info in random.sample(games, min(len(games), 5)):
+                timed(stats, "_get_state", info.obj._get_state)
+                timed(stats, "_get_players", info.obj._get_players)
+
+        except CORBA.OBJECT_NOT_EXIST:
+            # The game finished between listing and reading it
+            pass
+        except CORBA.SystemException as ex:
+            print("Reader error:", CORBA.id(ex), ex)
+            stats.error()
+
+
+def main(argv):
+    orb = CORBA.ORB_init(argv, CORBA.ORB_ID)
+    poa = orb.resolve_initial_references("RootPOA")
+    poa._get_the_POAManager().activate()
+
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument("factory", help="GameFactory IOR")
+    parser.add_argument("-c", "--clients", type=int, default=32)
+    parser.add_argument("-r", "--readers", type=int, default=8)
+    parser.add_argument("-t", "--time", type=float, default=30.0)
+    parser.add_argument("--json", action="store_true",
+                        help="also print the results as a line of JSON")
+    args = parser.parse_args(argv[1:])
+
+    factory = orb.string_to_object(args.factory)
+    factory = factory._narrow(TicTacToe.GameFactory)
+    if factory is None:
+        print("Object is not a GameFactory")
+        sys.exit(1)
+
+    stats = Stats()
+    stop = threading.Event()
+    prefix = "bench%d" % random.randrange(1000000)
+
+    threads = [threading.Thread(target=player,
+                                args=(factory, poa, "%s-%d" % (prefix, i),
+                                      stats, stop))
+               for i in range(args.clients)]
+    threads += [threading.Thread(target=reader, args=(factory, stats, stop))
+                for i in range(args.readers)]
+
+    print("Running %d players and %d readers for %g seconds..." %
+          (args.clients, args.readers, args.time))
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    time.sleep(args.time)
+    stop.set()
+
+    for t in threads:
+        t.join()
+
+    elapsed = time.perf_counter() - start
+    stats.report(elapsed)
+    if args.json:
+        print(json.dumps({"operations": stats.summary(elapsed),
+                          "errors": stats.errors}))
+    orb.destroy()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# benchMatrix.py
+
+"""Configuration sweep for the game server on localhost. For every
+combination of the settings swept, a game server is started with that
+configuration, benchContention.py is run against it as the workload,
+and the server is stopped again. The configurations are reported best
+first by the chosen objective, and the best can be written out as a
+configuration file for gameServer.py --config.
+
+  benchMatrix.py [-s section.name=value,...]... [-c clients] [-r readers]
+                 [-t secs] [--objective operation:metric] [-o best.cfg]
+
+Settings are named as in a configuration file, e.g. orb.model or
+server.notifier_threads; see serverConfig.py. With no -s options, the
+threading model, thread pool size and notifier threads are swept. The
+objective is one of the operations benchContention.py reports, and one
+of its metrics: rate is maximized, p50 and p99 are minimized.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import serverConfig
+
+DEFAULT_SWEEP = [
+    "orb.model=connection,pool",
+    "orb.maxServerThreadPoolSize=16,64",
+    "server.notifier_threads=4,16",
+]
+
+METRICS = ("rate", "p50", "p99")
+
+# Seconds to wait for a server to write its IOR
+START_TIMEOUT = 30
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parseSweep(text):
+    try:
+        key, values = text.split("=", 1)
+        section, name = key.split(".", 1)
+    except ValueError:
+        section = None
+
+    if section not in serverConfig.SECTIONS:
+        raise argparse.ArgumentTypeError(
+            "sweep must be orb.NAME=VALUE,... or server.NAME=VALUE,...")
+    return section, name, values.split(",")
+
+
+def parseObjective(text):
+    op, sep, metric = text.partition(":")
+    if not sep or metric not in METRICS:
+        raise argparse.ArgumentTypeError(
+            "objective must be OPERATION:" + "|".join(METRICS))
+    return op, metric
+
+
+def configurations(sweeps):
+    """Yield a ServerConfig for every combination of the swept values."""
+
+    for values in itertools.product(*[v for section, name, v in sweeps]):
+        config = serverConfig.ServerConfig()
+        for (section, name, v), value in zip(sweeps, values):
+            getattr(config, section)[name] = value
+        yield config
+
+
+def runOne(config, args, directory):
+    """Run the workload against a server with the given configuration,
+    returning benchContention.py's results."""
+
+    cfg = os.path.join(directory, "server.cfg")
+    ior = os.path.join(directory, "server.ior")
+    config.write(cfg)
+    if os.path.exists(ior):
+        os.remove(ior)
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "gameServer.py"),
+         "--config", cfg, "--no-naming", "--ior-file", ior],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        deadline = time.monotonic() + START_TIMEOUT
+        while not os.path.exists(ior):
+            if server.poll() is not None:
+                raise RuntimeError("server exited with status %d" %
+                                   server.returncode)
+            if time.monotonic() > deadline:
+                raise RuntimeError("server didn't start")
+            time.sleep(0.1)
+
+        with open(ior) as f:
+            factory = f.read()
+
+        out = subprocess.run(
+            [sys.executable, os.path.join(HERE, "benchContention.py"),
+             factory, "-c", str(args.clients), "-r", str(args.readers),
+             "-t", str(args.time), "--json"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+
+        return json.loads(out.stdout.splitlines()[-1])
+
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def score(result, objective):
+    """Return the objective, oriented so that bigger is better, or None
+    if the workload never performed the operation."""
+
+    op, metric = objective
+    stats = result["operations"].get(op)
+    if stats is None:
+        return None
+    return stats[metric] if metric == "rate" else -stats[metric]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument("-s", "--sweep", type=parseSweep, action="append",
+                        metavar="SECTION.NAME=VALUE,...",
+                        help="sweep a setting over the values given")
+    parser.add_argument("-c", "--clients", type=int, default=32)
+    parser.add_argument("-r", "--readers", type=int, default=8)
+    parser.add_argument("-t", "--time", type=float, default=10.0,
+                        help="seconds to run each configuration")
+    parser.add_argument("--objective", type=parseObjective,
+                        default=("play", "rate"),
+                        metavar="OPERATION:METRIC")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the best configuration to FILE")
+    args = parser.parse_args(argv[1:])
+
+    sweeps = args.sweep or [parseSweep(s) for s in DEFAULT_SWEEP]
+    configs = list(configurations(sweeps))
+    results = []
+
+    print("Sweeping %d configurations, %g seconds each, with %d players "
+          "and %d readers..." % (len(configs), args.time, args.clients,
+                                 args.readers))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for config in configs:
+            try:
+                result = runOne(config, args, directory)
+            except (RuntimeError, subprocess.CalledProcessError,
+                    ValueError) as ex:
+                print("%s: failed: %s" % (config.describe(), ex))
+                continue
+
+            s = score(result, args.objective)
+            results.append((s, result, config))
+            print("%s: %s" % (config.describe(),
+                              "no result" if s is None else "%.2f" % abs(s)))
+
+    ranked = sorted((r for r in results if r[0] is not None),
+                    key=lambda r: r[0], reverse=True)
+    if not ranked:
+        print("No configuration completed the workload.")
+        sys.exit(1)
+
+    op, metric = args.objective
+    print()
+    print("%4s %10s %7s  %s" % ("rank", op + " " + metric, "errors",
+                                "configuration"))
+    for rank, (s, result, config) in enumerate(ranked, 1):
+        print("%4d %10.2f %7d  %s" % (rank, abs(s), result["errors"],
+                                      config.describe()))
+
+    best = ranked[0][2]
+    print()
+    print("Best:", best.describe())
+    if args.output:
+        best.write(args.output)
+        print("Written to", args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
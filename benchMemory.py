@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# benchMemory.py
+
+"""Memory benchmark for the game server. Creates games in-process with a
+real ORB, first leaving them idle and then starting them (both players
+joined and one move made), and reports the memory used per game at
+each stage: resident set size, which includes the ORB's own
+allocations, and with -m, the Python heap as seen by tracemalloc.
+
+  benchMemory.py [-n games] [-m]
+"""
+
+import argparse
+import contextlib
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from omniORB import CORBA
+import TicTacToe__POA
+import board
+import gameServer
+
+
+class IdlePlayer_i(TicTacToe__POA.Player):
+    def yourGo(self, state):
+        pass
+
+    def end(self, state, winner):
+        pass
+
+    def gameAborted(self):
+        pass
+
+
+def rss():
+    """Return the resident set size of this process in bytes."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def heap():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def measure():
+    gc.collect()
+    return rss(), heap()
+
+
+def report(label, n, before, after):
+    print("%-24s %10.0f bytes RSS/game" % (label, (after[0] - before[0]) / n),
+          end="")
+    if tracemalloc.is_tracing():
+        print("  %10.0f bytes heap/game" % ((after[1] - before[1]) / n))
+    else:
+        print()
+
+
+def main(argv):
+    orb = CORBA.ORB_init(argv, CORBA.ORB_ID)
+    poa = orb.resolve_initial_references("RootPOA")
+    poa._get_the_POAManager().activate()
+
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument("-n", "--games", type=int, default=100000)
+    parser.add_argument("-m", "--tracemalloc", action="store_true",
+                        help="also measure the Python heap (slower)")
+    args = parser.parse_args(argv[1:])
+
+    n = args.games
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    player = poa.servant_to_reference(IdlePlayer_i())
+
+    # The servants announce themselves on stdout, which we don't want
+    # to time or keep.
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        factory = gameServer.GameFactory_i(poa, poolSize=0)
+        start = measure()
+
+        t = time.perf_counter()
+        for i in range(n):
+            factory.newGame("game-%d" % i)
+        created = time.perf_counter() - t
+        idle = measure()
+
+        t = time.perf_counter()
+        for name, game, obj, serial in factory._listing():
+            game.joinGame(player)
+            game.joinGame(player)
+            game._play(1, 1, board.NOUGHT)
+        started = time.perf_counter() - t
+        playing = measure()
+
+    print("%d games, created in %.2f s, started in %.2f s" %
+          (n, created, started))
+    report("idle game", n, start, idle)
+    report("in-progress game", n, start, playing)
+
+    orb.destroy()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,122 @@
+# board.py
+
+"""Rules engine for m x n, k games: players take turns to place pieces
+on a board of rows x cols squares, and the first to get k in a row,
+horizontally, vertically or diagonally, wins. Noughts and crosses is
+the 3, 3, 3 configuration.
+
+The engine knows nothing about CORBA, so it can be driven directly as
+well as through Game_i. Squares hold the ordinals of
+TicTacToe::PlayerType."""
+
+import array
+
+NOBODY, NOUGHT, CROSS = 0, 1, 2
+
+# Row and column steps of the four lines through a square
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+# Largest board newVariantGame() will create. Squares and move counts
+# are stored as uint16 by gameJournal and gameStore, and the journal
+# pads unplayed moves with 0xffff, so that can't be a square.
+MAX_CELLS = 0xffff
+
+
+class InvalidMove(Exception):
+    pass
+
+
+class InvalidCoordinates(InvalidMove):
+    pass
+
+
+class SquareOccupied(InvalidMove):
+    pass
+
+
+def validSpec(rows, cols, k):
+    return rows >= 1 and cols >= 1 and rows * cols <= MAX_CELLS and \
+        1 <= k <= max(rows, cols)
+
+
+class Board:
+    """A rows x cols board, stored packed row by row in a bytearray.
+    Only the four lines through the last move are examined for a win,
+    so each move costs O(k) however large the board is, and a draw is
+    detected by counting the filled squares. The squares played are
+    kept in order in moves, as indexes into cells."""
+
+    __slots__ = ("rows", "cols", "k", "cells", "filled", "moves")
+
+    def __init__(self, rows=3, cols=3, k=3):
+        if not validSpec(rows, cols, k):
+            raise ValueError("invalid board %dx%d,%d" % (rows, cols, k))
+
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.cells = bytearray(rows * cols)
+        self.filled = 0
+        self.moves = array.array("H")
+
+    def place(self, row, col, ptype):
+        """Place a piece for ptype. If that wins the game, return
+        ptype; if it fills the board, return NOBODY, otherwise return
+        None."""
+
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            raise InvalidCoordinates()
+
+        i = row * self.cols + col
+        if self.cells[i] != NOBODY:
+            raise SquareOccupied()
+
+        self.cells[i] = ptype
+        self.filled += 1
+        self.moves.append(i)
+
+        if self.winsAt(row, col):
+            return ptype
+
+        if self.filled == len(self.cells):
+            return NOBODY
+
+        return None
+
+    def winsAt(self, row, col):
+        """Return True if the piece at row, col is part of a line of k."""
+
+        cells = self.cells
+        rows = self.rows
+        cols = self.cols
+        k = self.k
+        ptype = cells[row * cols + col]
+
+        for dr, dc in DIRECTIONS:
+            count = 1
+
+            for sign in (1, -1):
+                r = row + dr * sign
+                c = col + dc * sign
+                while count < k and 0 <= r < rows and 0 <= c < cols and \
+                        cells[r * cols + c] == ptype:
+                    count += 1
+                    r += dr * sign
+                    c += dc * sign
+
+            if count >= k:
+                return True
+
+        return False
+
+    def get(self, row, col):
+        return self.cells[row * self.cols + col]
+
+    def packed(self):
+        return bytes(self.cells)
+
+    def nested(self):
+        """Return the board as a list of rows."""
+        cols = self.cols
+        return [list(self.cells[i:i + cols])
+                for i in range(0, len(self.cells), cols)]
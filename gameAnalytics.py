@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+# gameAnalytics.py
+
+"""Offline analysis of the game journals written by the server's
+--journal option. Games are loaded column by column into NumPy arrays,
+and every statistic is computed with array operations over all games
+at once, rather than by replaying games one at a time.
+
+  gameAnalytics.py journal-3x3x3.ttj [more journals for the same board]
+"""
+
+import sys
+import numpy as np
+import board
+import gameJournal
+
+# Squares in each word of a packed board
+WORD_BITS = 64
+
+# Bound on the board x line x word elements checked against the line
+# masks at a time, to bound the size of the intermediate arrays.
+CHUNK = 1 << 19
+
+
+def recordDtype(squares):
+    move = "u1" if gameJournal.moveFormat(squares) == "B" else "<u2"
+    return np.dtype([("nmoves", "<u2"),
+                     ("winner", "u1"),
+                     ("moves", move, (squares,))])
+
+
+def wordCount(squares):
+    return (squares + WORD_BITS - 1) // WORD_BITS
+
+
+def lineMasks(rows, cols, k):
+    """Return the bitmask of every line of k squares on the board, as
+    a pair of (lines, span) arrays: the indexes of the words of a
+    packed board that the line touches, and the line's bits in each
+    of them. A line touches at most k words, usually one or two, so
+    lines that touch fewer are padded with empty masks of word 0."""
+
+    lines = []
+    for r in range(rows):
+        for c in range(cols):
+            for dr, dc in board.DIRECTIONS:
+                if 0 <= r + dr * (k - 1) < rows and \
+                        0 <= c + dc * (k - 1) < cols:
+                    line = {}
+                    for i in range(k):
+                        w, bit = divmod((r + dr * i) * cols + c + dc * i,
+                                        WORD_BITS)
+                        line[w] = line.get(w, 0) | 1 << bit
+                    lines.append(line)
+
+    span = max((len(line) for line in lines), default=1)
+    words = np.zeros((len(lines), span), dtype=np.intp)
+    masks = np.zeros((len(lines), span), dtype=np.uint64)
+    for i, line in enumerate(lines):
+        words[i, :len(line)] = list(line)
+        masks[i, :len(line)] = list(line.values())
+
+    return words, masks
+
+
+def winners(boards, lines):
+    """Return the winner of each packed board in an array of them, as
+    board.NOUGHT, board.CROSS, or board.NOBODY if neither player has a
+    line. The boards are the last two axes of the array; lines is as
+    returned by lineMasks()."""
+
+    words, masks = lines
+    flat = boards.reshape((-1,) + boards.shape[-2:])
+    result = np.zeros(len(flat), dtype=np.uint8)
+    step = max(1, CHUNK // max(masks.size, 1))
+
+    for start in range(0, len(flat), step):
+        # (boards, players, lines, span)
+        chunk = flat[start:start + step][:, :, words]
+        won = ((chunk & masks) == masks).all(axis=3).any(axis=2)
+        result[start:start + step][won[:, 0]] = board.NOUGHT
+        result[start:start + step][won[:, 1]] = board.CROSS
+
+    return result.reshape(boards.shape[:-2])
+
+
+class GameSet:
+    """Completed games played on one kind of board, held as columns:
+    nmoves and winner have one entry per game, and moves holds each
+    game's squares in the order they were played, padded with the
+    journal's no-move value."""
+
+    def __init__(self, rows, cols, k, nmoves, winner, moves):
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.squares = rows * cols
+        self.nmoves = nmoves
+        self.winner = winner
+        self.moves = moves
+
+    @classmethod
+    def load(cls, paths):
+        spec = None
+        parts = []
+
+        for path in paths:
+            with open(path, "rb") as f:
+                s = gameJournal.readHeader(f)
+                if spec is not None and s != spec:
+                    raise ValueError("%s is for a %dx%d,%d board" %
+                                     ((path,) + s))
+                spec = s
+                parts.append(np.fromfile(f, dtype=recordDtype(s[0] * s[1])))
+
+        data = np.concatenate(parts)
+        rows, cols, k = spec
+        return cls(rows, cols, k, data["nmoves"], data["winner"],
+                   data["moves"])
+
+    def __len__(self):
+        return len(self.nmoves)
+
+    def plyBoards(self):
+        """Return the board after every ply of every game, as a
+        (games, squares, 2, words) uint64 array. Each board is packed
+        into two bit arrays of words, noughts' squares then crosses',
+        with square i in bit i % WORD_BITS of word i // WORD_BITS.
+        Plies after the end of a game repeat its final board. The
+        array grows with the square of the board's size; for large
+        boards, use finalBoards()."""
+
+        ply = np.arange(self.squares)
+        word, bit = self._moveBits()
+
+        # Crosses play the odd plies
+        bits = np.zeros((len(self), self.squares, 2, wordCount(self.squares)),
+                        dtype=np.uint64)
+        bits[np.arange(len(self))[:, None], ply, ply % 2, word] = bit
+
+        return np.bitwise_or.accumulate(bits, axis=1)
+
+    def finalBoards(self):
+        """Return the final board of every game, packed as by
+        plyBoards(), as a (games, 2, words) uint64 array."""
+
+        word, bit = self._moveBits()
+        games = np.arange(len(self))
+        boards = np.zeros((len(self), 2, wordCount(self.squares)),
+                          dtype=np.uint64)
+
+        # A square is played at most once per game, so this is one
+        # vectorized step per ply, whatever the number of games.
+        for ply in range(self.squares):
+            boards[games, ply % 2, word[:, ply]] |= bit[:, ply]
+
+        return boards
+
+    def _moveBits(self):
+        """Return the word index and bit of every move of every game,
+        as (games, squares) arrays. Moves after the end of a game are
+        an empty bit of word 0."""
+
+        played = np.arange(self.squares) < self.nmoves[:, None]
+        moves = np.where(played, self.moves, 0).astype(np.uint64)
+        word = (moves // np.uint64(WORD_BITS)).astype(np.intp)
+        bit = np.where(played, np.uint64(1) << (moves % np.uint64(WORD_BITS)),
+                       np.uint64(0))
+        return word, bit
+
+    def checkWinners(self):
+        """Judge every game's final board against the line masks, and
+        return the number of games whose recorded winner disagrees."""
+
+        final = self.finalBoards()
+        judged = winners(final, lineMasks(self.rows, self.cols, self.k))
+        return int(np.count_nonzero(judged != self.winner))
+
+    def lengthDistribution(self):
+        """Return the number of games of each length, indexed by the
+        number of moves."""
+        return np.bincount(self.nmoves, minlength=self.squares + 1)
+
+    def firstMoveStats(self):
+        """Return (games, nought wins, cross wins, draws) arrays indexed
+        by the square of the first move."""
+
+        first = self.moves[:, 0].astype(np.intp)
+        n = self.squares
+
+        def count(mask):
+            return np.bincount(first[mask], minlength=n)[:n]
+
+        return (count(self.nmoves > 0),
+                count(self.winner == board.NOUGHT),
+                count(self.winner == board.CROSS),
+                count((self.winner == board.NOBODY) & (self.nmoves > 0)))
+
+    def openings(self, depth=2, top=10):
+        """Return the most frequent sequences of the first depth moves,
+        as a list of (moves, games, nought wins, cross wins)."""
+
+        long_enough = self.nmoves >= depth
+        moves = self.moves[long_enough, :depth].astype(np.int64)
+        winner = self.winner[long_enough]
+
+        keys = np.zeros(len(moves), dtype=np.int64)
+        for i in range(depth):
+            keys = keys * self.squares + moves[:, i]
+
+        uniq, inverse, counts = np.unique(keys, return_inverse=True,
+                                          return_counts=True)
+        noughts = np.bincount(inverse, weights=winner == board.NOUGHT)
+        crosses = np.bincount(inverse, weights=winner == board.CROSS)
+
+        ret = []
+        for i in np.argsort(-counts, kind="stable")[:top]:
+            key = int(uniq[i])
+            seq = []
+            for _ in range(depth):
+                seq.append(key % self.squares)
+                key //= self.squares
+            ret.append((tuple(reversed(seq)), int(counts[i]),
+                        int(noughts[i]), int(crosses[i])))
+        return ret
+
+
+def square(gs, i):
+    return "%d,%d" % divmod(int(i), gs.cols)
+
+
+def report(gs):
+    print("%d games on a %dx%d board, %d in a row to win" %
+          (len(gs), gs.rows, gs.cols, gs.k))
+
+    print("Recorded winners disagreeing with the board:", gs.checkWinners())
+
+    total = max(len(gs), 1)
+    print()
+    print("Outcome:  noughts %.1f%%  crosses %.1f%%  draws %.1f%%" %
+          (100.0 * np.count_nonzero(gs.winner == board.NOUGHT) / total,
+           100.0 * np.count_nonzero(gs.winner == board.CROSS) / total,
+           100.0 * np.count_nonzero(gs.winner == board.NOBODY) / total))
+
+    print()
+    print("By first move:")
+    print("%-8s %10s %8s %8s %8s" % ("square", "games", "noughts",
+                                     "crosses", "draws"))
+    games, noughts, crosses, draws = gs.firstMoveStats()
+    for i in np.nonzero(games)[0]:
+        print("%-8s %10d %7.1f%% %7.1f%% %7.1f%%" %
+              (square(gs, i), games[i], 100.0 * noughts[i] / games[i],
+               100.0 * crosses[i] / games[i], 100.0 * draws[i] / games[i]))
+
+    print()
+    print("Most common openings:")
+    for moves, count, noughts, crosses in gs.openings():
+        print("%-20s %10d  noughts %.1f%%  crosses %.1f%%" %
+              (" ".join(square(gs, m) for m in moves), count,
+               100.0 * noughts / count, 100.0 * crosses / count))
+
+    print()
+    print("Game lengths:")
+    lengths = gs.lengthDistribution()
+    for n in np.nonzero(lengths)[0]:
+        print("%4d moves %10d" % (n, lengths[n]))
+
+
+def main(argv):
+    if len(argv) < 2:
+        print("Usage: %s <journal> [journal ...]" % argv[0])
+        sys.exit(1)
+
+    report(GameSet.load(argv[1:]))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -5,12 +5,122 @@
 
 import sys
 import threading
+import time
 from tkinter import *
 from omniORB import CORBA
 import PortableServer
 import TicTacToe
 import TicTacToe__POA
 
+# Seconds a game's cached status is used for, seconds between
+# background refreshes of the listed games, and games asked about in
+# each GameFactory::gameStatus() call.
+STATUS_TTL = 10.0
+REFRESH_INTERVAL = 2.0
+REFRESH_BATCH = 100
+
+
+class GameStatusCache(threading.Thread):
+    """Status of the games shown in the browser, so that selecting one
+    needn't contact the game. The listed games are refreshed in the
+    background, in batches, once their status is half way to
+    expiring; entries older than STATUS_TTL are never used. Games
+    asked for with request() are fetched in the next batch, whether
+    listed or not. hits and misses count the lookups answered from
+    the cache, and those that weren't."""
+
+    def __init__(self, gameFactory, ttl=STATUS_TTL):
+        super().__init__(name="GameStatusCache")
+        self.setDaemon(True)
+        self.gameFactory = gameFactory
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}   # name -> (TicTacToe.GameStatus, time fetched)
+        self.tracked = []   # names of the games listed
+        self.requests = {}  # name -> callbacks waiting for its status
+        self.wake = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.start()
+
+    def run(self):
+        while True:
+            self.wake.wait(REFRESH_INTERVAL)
+            self.wake.clear()
+
+            limit = time.monotonic() - self.ttl / 2
+            with self.lock:
+                requests, self.requests = self.requests, {}
+                names = list(requests)
+                names += [name for name in self.tracked
+                          if name not in requests and
+                          self.entries.get(name, (None, 0))[1] < limit]
+
+            try:
+                for i in range(0, len(names), REFRESH_BATCH):
+                    for status in self.fetch(names[i:i + REFRESH_BATCH]):
+                        for callback in requests.pop(status.name, ()):
+                            callback(status)
+
+            except CORBA.SystemException as ex:
+                print("System exception refreshing game status:")
+                print("  ", CORBA.id(ex), ex)
+
+            # Requests whose status couldn't be fetched
+            for callbacks in requests.values():
+                for callback in callbacks:
+                    callback(None)
+
+    def get(self, name):
+        """Return the cached status of a game, or None if there is no
+        fresh one."""
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            return None
+
+    def fetch(self, names):
+        """Fetch the status of the named games, returning it."""
+
+        statuses = self.gameFactory.gameStatus(names)
+        now = time.monotonic()
+
+        with self.lock:
+            for status in statuses:
+                self.entries[status.name] = (status, now)
+
+        return statuses
+
+    def request(self, name, callback):
+        """Fetch the status of a game in the background, and call
+        callback with it, or with None if it couldn't be fetched. The
+        callback is called on the cache's thread."""
+
+        with self.lock:
+            self.requests.setdefault(name, []).append(callback)
+        self.wake.set()
+
+    def track(self, names):
+        """Set the games to keep fresh, forgetting any others."""
+
+        with self.lock:
+            self.tracked = list(names)
+            self.entries = {name: self.entries[name] for name in self.tracked
+                            if name in self.entries}
+        self.wake.set()
+
+    def invalidate(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def stats(self):
+        return "status cache: %d hits, %d misses" % (self.hits, self.misses)
+
 
 class GameBrowser:
     """This class implements a top-level user interface to the game
@@ -22,6 +132,7 @@ class GameBrowser:
         self.orb = orb
         self.poa = poa
         self.gameFactory = gameFactory
+        self.statusCache = GameStatusCache(gameFactory)
         self.initGui()
         self.getGameList()
         print("GameBrowser initialized")
@@ -103,6 +214,12 @@ class GameBrowser:
         self.gameList = []
         self.listbox.delete(0, END)
 
+        try:
+            self._listGames()
+        finally:
+            self.statusCache.track([info.name for info in self.gameList])
+
+    def _listGames(self):
         try:
             seq, iterator = self.gameFactory.listGames(0)
         except CORBA.SystemException as ex:
@@ -144,19 +261,36 @@ class GameBrowser:
         index = int(selection[0])
         info = self.gameList[index]
 
-        try:
-            players = info.obj._get_players()
-            if players == 0:
-                msg = "No players yet"
-            elif players == 1:
-                msg = "One player waiting"
-            else:
-                msg = "Game in progress"
+        status = self.statusCache.get(info.name)
+        if status is not None:
+            self.showStatus(info, status)
+            return
 
-        except CORBA.SystemException as ex:
-            print("System exception contacting Game:")
-            print("  ", CORBA.id(ex), ex)
-            msg = "Error contacting Game object"
+        # Never wait for the factory here; the status is shown once the
+        # cache's thread has fetched it.
+        self.statusMessage(f"{info.name}: fetching status...")
+        self.statusCache.request(
+            info.name,
+            lambda status: self.master.after(0, self.showStatus, info, status))
+
+    def showStatus(self, info, status):
+        """Show the status of a game, if it is still the one selected.
+        status is None if it couldn't be fetched."""
+
+        selection = self.listbox.curselection()
+        if not selection or self.gameList[int(selection[0])] is not info:
+            return
+
+        if status is None:
+            msg = "Error contacting GameFactory"
+        elif not status.exists:
+            msg = "Game over"
+        elif status.players == 0:
+            msg = "No players yet"
+        elif status.players == 1:
+            msg = "One player waiting"
+        else:
+            msg = "Game in progress"
 
         self.statusMessage(f"{info.name}: {msg}")
 
@@ -212,6 +346,8 @@ class GameBrowser:
         index = int(selection[0])
         info = self.gameList[index]
 
+        self.statusCache.invalidate(info.name)
+
         pi = Player_i(self.master, info.name)
         id = poa.activate_object(pi)
         po = poa.id_to_reference(id)
@@ -272,6 +408,8 @@ class GameBrowser:
         index = int(selection[0])
         info = self.gameList[index]
 
+        self.statusCache.invalidate(info.name)
+
         try:
             info.obj.kill()
             msg = "killed"
@@ -540,6 +678,7 @@ orb_thread.start()
 browser.master.mainloop()
 
 # Após o loop do Tkinter terminar, desligue o ORB
+print(browser.statusCache.stats())
 print("Shutting down the ORB...")
 orb.shutdown(0)
 
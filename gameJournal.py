@@ -0,0 +1,95 @@
+# gameJournal.py
+
+"""Journal of completed games, written by the game server and read by
+gameAnalytics.py.
+
+Games on each kind of board go to a file of their own, named after the
+board, e.g. journal-3x3x3.ttj. The file starts with a header giving
+the board, followed by one fixed-size record per game:
+
+  uint16         number of moves
+  uint8          winner, as a TicTacToe::PlayerType ordinal
+  move[squares]  squares played, in order, as indexes into the board
+                 row by row, padded with NO_MOVE
+
+Moves are uint8 for boards of fewer than 255 squares, and uint16
+otherwise. Everything is little-endian. Since the records are all the
+same size, a journal can be loaded as an array in a single read."""
+
+import os
+import struct
+import threading
+
+MAGIC = b"TTTJ"
+VERSION = 1
+
+# magic, version, rows, cols, k, padded to 16 bytes
+HEADER = struct.Struct("<4sHHHH4x")
+
+RECORD_HEAD = struct.Struct("<HB")
+
+
+def moveFormat(squares):
+    """Return the struct format of a move on a board of that size."""
+    return "B" if squares < 0xff else "H"
+
+
+def noMove(squares):
+    return 0xff if squares < 0xff else 0xffff
+
+
+def journalName(rows, cols, k):
+    return "journal-%dx%dx%d.ttj" % (rows, cols, k)
+
+
+def readHeader(f):
+    """Read a journal header, returning (rows, cols, k)."""
+
+    magic, version, rows, cols, k = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version %d game journal" % VERSION)
+    return rows, cols, k
+
+
+def encodeRecord(rows, cols, moves, winner):
+    squares = rows * cols
+    fmt = "<%d%s" % (squares, moveFormat(squares))
+    padded = list(moves) + [noMove(squares)] * (squares - len(moves))
+    return RECORD_HEAD.pack(len(moves), winner) + struct.pack(fmt, *padded)
+
+
+class JournalWriter:
+    """Appends completed games to the journals in a directory. Safe to
+    call from any thread."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, board, winner):
+        """Record a finished game played on a board.Board."""
+
+        data = encodeRecord(board.rows, board.cols, board.moves, winner)
+
+        with self.lock:
+            f = self._file(board.rows, board.cols, board.k)
+            f.write(data)
+            f.flush()
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+    def _file(self, rows, cols, k):
+        f = self.files.get((rows, cols, k))
+        if f is None:
+            path = os.path.join(self.directory, journalName(rows, cols, k))
+            f = open(path, "ab")
+            if f.tell() == 0:
+                f.write(HEADER.pack(MAGIC, VERSION, rows, cols, k))
+            self.files[(rows, cols, k)] = f
+        return f
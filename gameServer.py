@@ -1,50 +1,412 @@
 import sys
+import argparse
+import os
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import secrets
+import struct
 import threading
+import traceback
 import time
-from queue import Queue
+import weakref
+import omniORB
 import CORBA
 import PortableServer
+import PortableServer__POA
 import CosNaming
 import TicTacToe
 import TicTacToe__POA
+import board
+import gameJournal
+import gameStore
+import profiling
+import serverConfig
 
 SCAVENGER_INTERVAL = 30
 
+# Number of spectators a game (or relay) calls directly before new
+# watchers are handed to spectator relays, and the number of relays
+# it feeds directly before it starts sharing watchers between them.
+RELAY_THRESHOLD = 64
+RELAY_FANOUT = 8
+
+# Bounds on queued spectator notifications, per game and across all
+# games, the age after which a queued update is thrown away, and the
+# policy applied when a queue is full. See NotificationQueue.
+NOTIFY_QUEUE_SIZE = 32
+NOTIFY_GLOBAL_SIZE = 100000
+NOTIFY_MAX_AGE = 10.0
+NOTIFY_POLICY = "drop-oldest"
+
+# A spectator whose last call took longer than this is evicted first
+# under the evict-slow policy.
+SLOW_SPECTATOR_TIME = 1.0
+
+# Seconds a call to a spectator may take before it fails with
+# TRANSIENT, so that a hung spectator only holds up a notifier thread
+# for that long. 0 for no limit.
+SPECTATOR_CALL_TIMEOUT = 10.0
+
+# Threads shared by the notifiers of all games, and the number of
+# notifications one of them delivers for a game before moving on.
+NOTIFIER_THREADS = 8
+NOTIFY_BATCH = 16
+
+# With a game store, games are hibernated after HIBERNATE_AFTER seconds
+# without a request, and the least recently used ones whenever more
+# than MAX_RESIDENT_GAMES are in memory. The hibernator looks for them
+# every HIBERNATE_INTERVAL seconds.
+HIBERNATE_AFTER = 300.0
+MAX_RESIDENT_GAMES = 100000
+HIBERNATE_INTERVAL = 10
+
+# Threads that tell players and spectators about games killed in bulk,
+# and deactivate them.
+TEARDOWN_THREADS = 4
+
+# Most moves returned by one Game::getMoves() call, and most updates
+# replayed to a spectator by watchGameFrom().
+MOVE_PAGE_SIZE = 1024
+MAX_REPLAY = 256
+
+# Ready-made game servants kept for newGame(), and controllers for
+# joinGame(); see GamePool.
+GAME_POOL_SIZE = 256
+
+TERMINAL_NOTIFICATIONS = ("end", "endPacked", "gameAborted")
+
+# Notifications that are never dropped or expired: the terminal ones,
+# and spectator registrations, which are queued to the notifier.
+KEPT_NOTIFICATIONS = TERMINAL_NOTIFICATIONS + ("_register", "_unregister")
+
+# Settings a configuration file may change, in its [server] section.
+# See serverConfig.py.
+SETTINGS = ("SCAVENGER_INTERVAL", "RELAY_THRESHOLD", "RELAY_FANOUT",
+            "NOTIFY_QUEUE_SIZE", "NOTIFY_GLOBAL_SIZE", "NOTIFY_MAX_AGE",
+            "NOTIFY_POLICY", "SLOW_SPECTATOR_TIME",
+            "SPECTATOR_CALL_TIMEOUT", "NOTIFIER_THREADS", "NOTIFY_BATCH", "HIBERNATE_AFTER", "MAX_RESIDENT_GAMES",
+            "HIBERNATE_INTERVAL", "TEARDOWN_THREADS", "MOVE_PAGE_SIZE",
+            "MAX_REPLAY", "GAME_POOL_SIZE")
+
+# TicTacToe::PlayerType values, indexed by the ordinals board.py uses
+PLAYER_TYPES = (TicTacToe.Nobody, TicTacToe.Nought, TicTacToe.Cross)
+
+# Immutable view of a game published after every change. state is the
+# GameState for 3, 3, 3 games and None otherwise; packed is the
+# PackedState.
+GameSnapshot = collections.namedtuple("GameSnapshot", "players state packed")
+
+
+@functools.lru_cache(maxsize=None)
+def classicState(packed):
+    """Return the GameState of a packed 3 x 3 board. There are at most
+    3**9 of them, so they are cached, and every game in the same
+    position shares one."""
+    return tuple(tuple(PLAYER_TYPES[c] for c in packed[i:i + 3])
+                 for i in (0, 3, 6))
+
+
+def replayStates(packed, moves, first, classic):
+    """Generate the callback states after each of moves, the last of
+    which gave the packed state, and the first of which was move
+    number first."""
+
+    cells = bytearray(packed)
+    for i in moves:
+        cells[i] = board.NOBODY
+
+    for seq, i in enumerate(moves, first):
+        cells[i] = board.NOUGHT if seq % 2 == 0 else board.CROSS
+        state = bytes(cells)
+        yield classicState(state) if classic else state
+
+
+# Object ids in the game POA are the game's name and serial number,
+# and for controllers the player type, separated by NULs, which IDL
+# strings cannot contain. The serial is drawn at random for each new
+# game, so references to a killed game never reach a later game of the
+# same name, and a controller's reference can't be made up from the
+# game's name.
+
+def gameId(name, serial):
+    return b"%s\0%d" % (name.encode("utf-8"), serial)
+
+
+def controllerId(name, serial, ptype):
+    return b"%s\0%d" % (gameId(name, serial), ptype)
+
+
+def parseId(oid):
+    """Return (name, serial, ptype) from an object id in the game POA,
+    with ptype None for a game's id. Raises ValueError if the id is
+    not one of ours."""
+
+    parts = oid.split(b"\0")
+    if len(parts) not in (2, 3):
+        raise ValueError("bad object id")
+
+    ptype = int(parts[2]) if len(parts) == 3 else None
+    return parts[0].decode("utf-8"), int(parts[1]), ptype
+
+
 class GameFactory_i(TicTacToe__POA.GameFactory):
-    def __init__(self, poa):
-        self.games = []
+
+    # The game registry is read far more often than it is changed, so
+    # listGames() works from an immutable snapshot of it, which is
+    # only rebuilt after the registry has changed. Changes are O(1)
+    # under self.lock. Iterators and relay hosts have locks of their
+    # own, so neither holds up game creation and removal.
+
+    def __init__(self, poa, poolSize=None, started=None):
+        self.games = {}      # name -> (name, servant, reference, serial)
+        self.listing = ()    # snapshot of games.values(), None if stale
         self.iterators = {}
+        self.relayHosts = []
+        self.nextRelayHost = 0
         self.lock = threading.Lock()
+        self.iteratorLock = threading.Lock()
+        self.relayLock = threading.Lock()
         self.poa = poa
+        self.journal = None  # gameJournal.JournalWriter, if recording
+        self.hibernator = None  # GameHibernator, if hibernating
+
+        # Every game and game controller is activated in the one POA,
+        # under an object id made from the game's name. Requests for
+        # objects that aren't active go to the GameActivator_i, which
+        # brings back hibernated games.
+        policies = [poa.create_id_assignment_policy(PortableServer.USER_ID),
+                    poa.create_servant_retention_policy(PortableServer.RETAIN),
+                    poa.create_request_processing_policy(
+                        PortableServer.USE_SERVANT_MANAGER)]
+        self.game_poa = poa.create_POA("GamePOA", None, policies)
+        self.game_poa.set_servant_manager(GameActivator_i(self)._this())
+        self.game_poa._get_the_POAManager().activate()
 
         self.iterator_poa = poa.create_POA("IterPOA", None, [])
         self.iterator_poa._get_the_POAManager().activate()
 
         self.iterator_scavenger = IteratorScavenger(self)
 
+        # For reporting the time to the first game
+        self.started = time.perf_counter() if started is None else started
+        self.firstGame = None
+
+        self.pool = GamePool(self, GAME_POOL_SIZE if poolSize is None
+                             else poolSize)
+
         print("GameFactory_i created.")
 
     def newGame(self, name):
-        try:
-            game_poa = self.poa.create_POA("Game-" + name, None, [])
+        return self._newGame(name, 3, 3, 3)
 
-        except PortableServer.POA.AdapterAlreadyExists:
-            raise TicTacToe.GameFactory.NameInUse()
+    def newVariantGame(self, name, spec):
+        if not board.validSpec(spec.rows, spec.cols, spec.k):
+            raise TicTacToe.GameFactory.InvalidSpec()
 
-        gservant = Game_i(self, name, game_poa)
-        gid = game_poa.activate_object(gservant)
-        gobj = game_poa.id_to_reference(gid)
-        game_poa._get_the_POAManager().activate()
+        return self._newGame(name, spec.rows, spec.cols, spec.k)
 
+    def _newGame(self, name, rows, cols, k):
         with self.lock:
-            self.games.append((name, gservant, gobj))
+            if name in self.games:
+                raise TicTacToe.GameFactory.NameInUse()
 
-        return gobj
+            # Reserve the name while the game is created
+            self.games[name] = None
 
-    def listGames(self, how_many):
+        entry = self._activateGame(name, rows, cols, k)
+
+        with self.lock:
+            if entry is None:
+                del self.games[name]
+                raise TicTacToe.GameFactory.NameInUse()
+
+            self.games[name] = entry
+            self.listing = None
+
+        self._created()
+        return entry[2]
+
+    def newGames(self, names):
+        # The names are reserved, and the games registered, in one
+        # update of the registry each.
         with self.lock:
-            front = self.games[:int(how_many)]
-            rest = self.games[int(how_many):]
+            fresh = []
+            for name in names:
+                if name not in self.games:
+                    self.games[name] = None
+                    fresh.append(name)
+
+        entries = {name: self._activateGame(name, 3, 3, 3) for name in fresh}
+
+        with self.lock:
+            for name, entry in entries.items():
+                if entry is None:
+                    del self.games[name]
+                else:
+                    self.games[name] = entry
+            self.listing = None
+
+        if any(entry is not None for entry in entries.values()):
+            self._created()
+
+        ret = []
+        for name in names:
+            entry = entries.pop(name, None)
+            if entry is None:
+                ret.append(TicTacToe.GameResult(name, None, "NameInUse"))
+            else:
+                ret.append(TicTacToe.GameResult(name, entry[2], ""))
+        return ret
+
+    def _activateGame(self, name, rows, cols, k):
+        """Create and activate a game whose name has been reserved.
+        Returns its registry entry, or None if a game of the same name
+        is still being deactivated."""
+
+        try:
+            if (rows, cols, k) == (3, 3, 3):
+                gservant = self.pool.game(name)
+            else:
+                gservant = Game_i(self, name, rows, cols, k)
+            gid = gameId(name, gservant.serial)
+            self.game_poa.activate_object_with_id(gid, gservant)
+            return (name, gservant, self.game_poa.id_to_reference(gid),
+                    gservant.serial)
+
+        except PortableServer.POA.ObjectAlreadyActive:
+            return None
+
+    def _created(self):
+        if self.firstGame is None:
+            self.firstGame = time.perf_counter() - self.started
+            print("First game created %.3f s after startup" % self.firstGame)
+
+    def killGames(self, filter):
+        prefix = filter.prefix
+
+        def matches(name, players, lastUsed):
+            return name.startswith(prefix) and \
+                filter.minPlayers <= players <= filter.maxPlayers
+
+        names = list(dict.fromkeys(filter.names)) or None
+        ret = self._killGames(self._selectGames(matches, names))
+
+        killed = set(r.name for r in ret)
+        for name in dict.fromkeys(filter.names):
+            if name not in killed:
+                error = "NoMatch" if name in self.games else "NoSuchGame"
+                ret.append(TicTacToe.GameResult(name, None, error))
+        return ret
+
+    def killIdleOlderThan(self, seconds):
+        limit = time.monotonic() - seconds
+        return self._killGames(self._selectGames(
+            lambda name, players, lastUsed: lastUsed < limit))
+
+    def _selectGames(self, test, names=None):
+        """Return the names of the games for which test(name, players,
+        lastUsed) is true, hibernated ones included. If names is given,
+        only those games are looked at."""
+
+        hibernator = self.hibernator
+        ret = []
+
+        if names is None:
+            entries = self._listing()
+        else:
+            entries = [entry for entry in map(self.games.get, names)
+                       if entry is not None]
+
+        for name, servant, obj, serial in entries:
+            if servant is not None:
+                players, lastUsed = servant.players, servant.lastUsed
+            else:
+                data = hibernator.store.get(name) if hibernator else None
+                if data is None:
+                    continue
+                players, lastUsed = gameStore.peekGame(data)
+
+            if test(name, players, lastUsed):
+                ret.append(name)
+
+        return ret
+
+    def _killGames(self, names):
+        """Remove the named games in one update of the registry, and
+        schedule the rest of killing them on the teardown pool."""
+
+        hibernator = self.hibernator
+        killed = []
+
+        # Holding the hibernator's lock keeps games from being brought
+        # back while they are removed.
+        with hibernator.lock if hibernator else contextlib.nullcontext():
+            with self.lock:
+                for name in names:
+                    entry = self.games.get(name)
+                    if entry is not None:
+                        del self.games[name]
+                        killed.append(entry)
+                if killed:
+                    self.listing = None
+
+            hibernated = [(entry, hibernator.store.take(entry[0]))
+                          for entry in killed if entry[1] is None]
+
+        for name, servant, obj, serial in killed:
+            if servant is not None:
+                teardownPool.submit(servant._abort)
+
+        for entry, data in hibernated:
+            if data is not None:
+                teardownPool.submit(self._abortHibernated, entry[0], data)
+
+        print("Killed %d games" % len(killed))
+        return [TicTacToe.GameResult(entry[0], None, "") for entry in killed]
+
+    def gameStatus(self, names):
+        ret = []
+        for name in names:
+            status = self._status(name)
+            if status is None:
+                ret.append(TicTacToe.GameStatus(name, False, 0, 0, b""))
+            else:
+                players, packed = status
+                ret.append(TicTacToe.GameStatus(
+                    name, True, players,
+                    len(packed) - packed.count(board.NOBODY), packed))
+        return ret
+
+    def _status(self, name):
+        """Return (players, packed state) of a game, hibernated or not,
+        or None if there is no such game. Resident games are reported
+        from their published snapshots, so no game's lock is taken."""
+
+        entry = self.games.get(name)
+        if entry is None:
+            return None
+
+        if entry[1] is not None:
+            snapshot = entry[1].snapshot
+            return snapshot.players, snapshot.packed
+
+        data = self.hibernator.store.get(name) if self.hibernator else None
+        if data is None:
+            return None
+
+        b, players, serial, iors = gameStore.decodeGame(data)
+        return players, b.packed()
+
+    def _abortHibernated(self, name, data):
+        Game_i._thaw(self, name, data, self.hibernator.orb)._abort()
+
+    def listGames(self, how_many):
+        games = self._listing()
+        front = games[:int(how_many)]
+        rest = games[int(how_many):]
 
         ret = list(map(lambda g: TicTacToe.GameInfo(g[0], g[2]), front))
 
@@ -52,19 +414,67 @@ class GameFactory_i(TicTacToe__POA.GameFactory):
             iter = GameIterator_i(self, self.iterator_poa, rest)
             iid = self.iterator_poa.activate_object(iter)
             iobj = self.iterator_poa.id_to_reference(iid)
-            with self.lock:
+            with self.iteratorLock:
                 self.iterators[iid] = iter
         else:
             iobj = None
 
         return ret, iobj
 
+    def registerRelayHost(self, host):
+        with self.relayLock:
+            self.relayHosts.append(host)
+
+        print("Relay host registered.")
+
+    def notifierStats(self):
+        queues = sorted(notificationBudget.allQueues(), key=lambda q: q.name)
+        ret = [TicTacToe.NotifierStats(q.name, q.qsize(), q.dropped,
+                                       q.expired, q.evicted)
+               for q in queues]
+
+        b = notificationBudget
+        totals = TicTacToe.NotifierStats("", b.depth, b.dropped,
+                                         b.expired, b.evicted)
+        return ret, totals
+
+    def hibernationStats(self):
+        if self.hibernator is None:
+            return TicTacToe.HibernationStats(len(self._listing()), 0, 0, 0,
+                                              0.0, 0.0, 0.0, 0.0)
+        return self.hibernator.stats()
+
+    def _relayHost(self):
+        with self.relayLock:
+            if not self.relayHosts:
+                return None
+
+            host = self.relayHosts[self.nextRelayHost % len(self.relayHosts)]
+            self.nextRelayHost += 1
+            return host
+
+    def _relayHostLost(self, host):
+        with self.relayLock:
+            if host in self.relayHosts:
+                self.relayHosts.remove(host)
+
+    def _listing(self):
+        games = self.listing
+        if games is None:
+            with self.lock:
+                games = self.listing
+                if games is None:
+                    games = self.listing = tuple(
+                        g for g in self.games.values() if g is not None)
+        return games
+
     def _removeGame(self, name):
         with self.lock:
-            self.games = [game for game in self.games if game[0] != name]
+            if self.games.pop(name, None):
+                self.listing = None
 
     def _removeIterator(self, iid):
-        with self.lock:
+        with self.iteratorLock:
             del self.iterators[iid]
 
 
@@ -105,7 +515,7 @@ class IteratorScavenger(threading.Thread):
     def run(self):
         print("Iterator scavenger running...")
 
-        lock = self.factory.lock
+        lock = self.factory.iteratorLock
         iterators = self.factory.iterators
         poa = self.factory.iterator_poa
         manager = poa._get_the_POAManager()
@@ -126,62 +536,473 @@ class IteratorScavenger(threading.Thread):
             manager.activate()
 
 
-class Game_i(TicTacToe__POA.Game):
-    def __init__(self, factory, name, poa):
+class GamePool(threading.Thread):
+    """Ready-made servants for 3, 3, 3 games, and game controllers, so
+    that the burst of newGame() and joinGame() calls that follows a
+    restart doesn't pay for building them. The pool is filled when it
+    is created, and refilled in the background whenever either kind
+    falls below half full. An empty pool just builds servants as they
+    are needed."""
+
+    def __init__(self, factory, size):
+        super().__init__(name="GamePool")
+        self.setDaemon(True)
+        self.factory = factory
+        self.size = size
+        self.games = collections.deque()
+        self.controllers = collections.deque()
+        self.low = threading.Event()
+        self.fill()
+        if size:
+            self.start()
+
+    def run(self):
+        while True:
+            self.low.wait()
+            self.low.clear()
+            self.fill()
+
+    def fill(self):
+        while len(self.games) < self.size:
+            self.games.append(Game_i(self.factory, None))
+
+        while len(self.controllers) < 2 * self.size:
+            self.controllers.append(GameController_i(None, board.NOBODY))
+
+    def game(self, name):
+        try:
+            game = self.games.popleft()
+        except IndexError:
+            return Game_i(self.factory, name)
+
+        game.name = name
+        game.lastUsed = time.monotonic()
+        self._taken(self.games, self.size)
+        print("Game_i created.")
+        return game
+
+    def controller(self, game, ptype):
+        try:
+            gc = self.controllers.popleft()
+        except IndexError:
+            return GameController_i(game, ptype)
+
+        gc.game = game
+        gc.ptype = ptype
+        self._taken(self.controllers, 2 * self.size)
+        print("GameController_i created.")
+        return gc
+
+    def _taken(self, ready, size):
+        if len(ready) < size // 2:
+            self.low.set()
+
+
+class GameActivator_i(PortableServer__POA.ServantActivator):
+    """Servant manager of the game POA. It is asked for the servant of
+    any game or controller object id that isn't active, and brings the
+    game back from the game store if it has been hibernated, so object
+    references to hibernated games stay valid."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def incarnate(self, oid, poa):
+        try:
+            name, serial, ptype = parseId(oid)
+        except (ValueError, UnicodeDecodeError):
+            raise CORBA.OBJECT_NOT_EXIST(0, CORBA.COMPLETED_NO)
+
+        hibernator = self.factory.hibernator
+
+        game = None
+        if hibernator is not None:
+            game = hibernator.reactivate(name, serial)
+
+        if game is None:
+            raise CORBA.OBJECT_NOT_EXIST(0, CORBA.COMPLETED_NO)
+
+        if ptype is None:
+            return game
+
+        if ptype not in (board.NOUGHT, board.CROSS) or ptype > game.players:
+            raise CORBA.OBJECT_NOT_EXIST(0, CORBA.COMPLETED_NO)
+
+        return GameController_i(game, ptype)
+
+    def etherealize(self, oid, poa, servant, cleanup_in_progress,
+                    remaining_activations):
+        pass
+
+
+class GameHibernator(threading.Thread):
+    """Hibernates idle games to a GameStore, and brings them back when
+    they are next used.
+
+    Every HIBERNATE_INTERVAL seconds, games that have had no requests
+    for idleTime seconds are hibernated, and if more than maxResident
+    are still in memory, so are the least recently used of the rest.
+    A game is encoded to the store before its servants are
+    deactivated, so once they are, the next request for any of its
+    objects finds it there. Games with spectators are never
+    hibernated."""
+
+    def __init__(self, factory, orb, store, idleTime=None, maxResident=None):
+        super().__init__(name="GameHibernator")
+        self.setDaemon(True)
+        self.factory = factory
+        self.orb = orb
+        self.store = store
+        self.idleTime = HIBERNATE_AFTER if idleTime is None else idleTime
+        self.maxResident = MAX_RESIDENT_GAMES if maxResident is None \
+            else maxResident
+        self.lock = threading.Lock()        # serializes (re)activation
+        self.statsLock = threading.Lock()
+        self.wake = threading.Event()
+        self.hibernations = [0, 0.0, 0.0]   # count, total and worst time
+        self.reactivations = [0, 0.0, 0.0]
+        self.start()
+
+    def run(self):
+        print("Game hibernator running...")
+
+        while True:
+            self.wake.wait(HIBERNATE_INTERVAL)
+            self.wake.clear()
+            self.sweep()
+
+    def sweep(self):
+        resident = [g[1] for g in self.factory._listing()
+                    if g[1] is not None]
+        limit = time.monotonic() - self.idleTime
+
+        idle = [game for game in resident if game.lastUsed < limit]
+        excess = len(resident) - len(idle) - self.maxResident
+        if excess > 0:
+            busy = [game for game in resident if game.lastUsed >= limit]
+            idle += heapq.nsmallest(excess, busy,
+                                    key=lambda game: game.lastUsed)
+
+        count = sum(self.hibernate(game) for game in idle)
+        if count:
+            print("Hibernated %d games" % count)
+
+    def hibernate(self, game):
+        """Hibernate a game, returning False if it can't be."""
+
+        start = time.perf_counter()
+        factory = self.factory
+
+        # Requests that reach the frozen servant are handed to
+        # reactivate(), which waits until the game is in the store.
+        with self.lock:
+            data = game._freeze(self.orb)
+            if data is None:
+                return False
+
+            self.store.put(game.name, data)
+
+            with factory.lock:
+                entry = factory.games.get(game.name)
+                if entry is not None and entry[1] is game:
+                    factory.games[game.name] = (game.name, None, entry[2],
+                                                entry[3])
+                    factory.listing = None
+                else:
+                    entry = None
+
+            if entry is None:
+                # Killed while we were freezing it
+                self.store.take(game.name)
+                return False
+
+        game._deactivate()
+        self._count(self.hibernations, time.perf_counter() - start)
+        return True
+
+    def reactivate(self, name, serial):
+        """Return the servant of the named game, bringing it back from
+        the store if it has been hibernated, or None if there is no
+        such game with the given serial number."""
+
+        factory = self.factory
+
+        with self.lock:
+            with factory.lock:
+                entry = factory.games.get(name)
+            if entry is None or entry[3] != serial:
+                return None
+            if entry[1] is not None:
+                return entry[1]
+
+            start = time.perf_counter()
+            data = self.store.take(name)
+            if data is None:
+                return None
+
+            game = Game_i._thaw(factory, name, data, self.orb)
+
+            with factory.lock:
+                factory.games[name] = (name, game, entry[2], serial)
+                factory.listing = None
+
+        self._count(self.reactivations, time.perf_counter() - start)
+
+        if len(factory.games) - len(self.store) > self.maxResident:
+            self.wake.set()
+
+        return game
+
+    def stats(self):
+        hibernated = len(self.store)
+
+        with self.statsLock:
+            h, r = self.hibernations, self.reactivations
+            return TicTacToe.HibernationStats(
+                len(self.factory.games) - hibernated, hibernated, h[0], r[0],
+                1000.0 * h[1] / max(h[0], 1), 1000.0 * h[2],
+                1000.0 * r[1] / max(r[0], 1), 1000.0 * r[2])
+
+    def _count(self, counts, duration):
+        with self.statsLock:
+            counts[0] += 1
+            counts[1] += duration
+            counts[2] = max(counts[2], duration)
+
+
+class Hibernated(Exception):
+    """Raised by Game_i._touch() when the game has been hibernated."""
+
+
+def forwardHibernated(method):
+    """Decorate a Game_i method that changes the game, so that if the
+    game turns out to have been hibernated, the call is made again on
+    the game brought back in its place. The method must raise
+    Hibernated before it has done anything else."""
+
+    @functools.wraps(method)
+    def forward(self, *args):
+        try:
+            return method(self, *args)
+        except Hibernated:
+            return getattr(self._reactivated(), method.__name__)(*args)
+
+    return forward
+
+
+class Game_i(TicTacToe__POA.VariantGame):
+    """A game on an m x n board, needing k in a row to win. Noughts and
+    crosses is the 3, 3, 3 configuration; only those games support the
+    operations that use GameState, and notify their players and
+    spectators with it. Other games use PackedState throughout."""
+
+    # Joins and moves are serialized by self.moveLock, which is only
+    # ever held for local work. Each change publishes a new immutable
+    # GameSnapshot, which the attribute accessors read without taking
+    # any lock. Players are called once the lock has been released,
+    # and spectators are registered through the notifier's queue, so
+    # no remote call is ever made with a lock held.
+    #
+    # A server may hold a great many idle games, so the servant keeps
+    # its fields in __slots__, and its SpectatorGroup is only created
+    # when somebody first watches the game. The skeleton base classes
+    # don't declare __slots__, so servants still have an instance
+    # dictionary; the slots just keep the fields out of it.
+    #
+    # Games nobody is watching can be hibernated to the game store
+    # once they have been idle a while; see GameHibernator. A request
+    # that reaches a servant after its game has been hibernated is
+    # handed on to the reactivated game by @forwardHibernated.
+
+    __slots__ = ("factory", "name", "moveLock", "players", "board",
+                 "classic", "p_noughts", "p_crosses", "whose_go",
+                 "snapshot", "spectators", "lastUsed", "hibernated",
+                 "serial")
+
+    def __init__(self, factory, name, rows=3, cols=3, k=3):
         self.factory = factory
         self.name = name
-        self.poa = poa
-        self.lock = threading.Lock()
+        self.serial = secrets.randbits(63)
+        self.moveLock = threading.Lock()
 
-        n = TicTacToe.Nobody
         self.players = 0
-        self.state = [[n, n, n], [n, n, n], [n, n, n]]
+        self.board = board.Board(rows, cols, k)
+        self.classic = (rows, cols, k) == (3, 3, 3)
 
         self.p_noughts = None
         self.p_crosses = None
-        self.whose_go = TicTacToe.Nobody
-        self.spectators = []
-        self.spectatorNotifier = SpectatorNotifier(self.spectators, self.lock)
-
-        print("Game_i created.")
+        self.whose_go = board.NOBODY
+        self.spectators = None
+        self.lastUsed = time.monotonic()
+        self.hibernated = False
+        self._publish()
+
+        # Pooled servants are reported when GamePool hands them out
+        if name is not None:
+            print("Game_i created.")
+
+    @classmethod
+    def _thaw(cls, factory, name, data, orb):
+        """Rebuild a game hibernated by _freeze()."""
+
+        b, players, serial, iors = gameStore.decodeGame(data)
+        game = cls(factory, name, b.rows, b.cols, b.k)
+        game.board = b
+        game.players = players
+        game.serial = serial
+
+        ptype = TicTacToe.Player if game.classic else TicTacToe.VariantPlayer
+        game.p_noughts, game.p_crosses = [
+            orb.string_to_object(ior)._narrow(ptype) if ior else None
+            for ior in iors]
+
+        if players == 2:
+            game.whose_go = board.NOUGHT if len(b.moves) % 2 == 0 \
+                else board.CROSS
+
+        game._publish()
+        return game
+
+    def _freeze(self, orb):
+        """Mark the game hibernated, and return its encoded state for
+        the game store. Returns None, leaving the game alone, if it is
+        being watched, or is over."""
+
+        with self.moveLock:
+            if self.hibernated or self.spectators is not None or \
+                    (self.players == 2 and self.whose_go == board.NOBODY):
+                return None
+
+            iors = [orb.object_to_string(p) if p is not None else None
+                    for p in (self.p_noughts, self.p_crosses)]
+            self.hibernated = True
+            return gameStore.encodeGame(self.board, self.players,
+                                        self.serial, iors, self.lastUsed)
+
+    def _get_name(self):
+        return self.name
+
+    def _get_players(self):
+        self.lastUsed = time.monotonic()
+        return self.snapshot.players
+
+    def _get_state(self):
+        if not self.classic:
+            raise CORBA.BAD_OPERATION(0, CORBA.COMPLETED_NO)
+        self.lastUsed = time.monotonic()
+        return self.snapshot.state
+
+    def _get_spec(self):
+        b = self.board
+        return TicTacToe.BoardSpec(b.rows, b.cols, b.k)
+
+    def _get_packedState(self):
+        self.lastUsed = time.monotonic()
+        return self.snapshot.packed
 
     def joinGame(self, player):
-        with self.lock:
+        if not self.classic:
+            raise TicTacToe.Game.CannotJoin()
+        return self._join(player)
+
+    def joinVariant(self, player):
+        return self._join(player)
+
+    @forwardHibernated
+    def _join(self, player):
+        with self.moveLock:
+            self._touch()
             if self.players == 2:
                 raise TicTacToe.Game.CannotJoin()
 
             if self.players == 0:
-                ptype = TicTacToe.Nought
+                ptype = board.NOUGHT
                 self.p_noughts = player
+                first = None
             else:
-                ptype = TicTacToe.Cross
+                ptype = board.CROSS
                 self.p_crosses = player
-                self.whose_go = TicTacToe.Nought
-                self.p_noughts.yourGo(self.state)
+                self.whose_go = board.NOUGHT
+                first = self.p_noughts
 
-            gc = GameController_i(self, ptype)
-            id = self.poa.activate_object(gc)
-            gobj = self.poa.id_to_reference(id)
+            gc = self.factory.pool.controller(self, ptype)
+            id = controllerId(self.name, self.serial, ptype)
+            self.factory.game_poa.activate_object_with_id(id, gc)
+            gobj = self.factory.game_poa.id_to_reference(id)
             self.players += 1
+            snapshot = self._publish()
+
+        if first is not None:
+            self._yourGo(first, snapshot)
 
-        return gobj, ptype
+        return gobj, PLAYER_TYPES[ptype]
 
+    @forwardHibernated
     def watchGame(self, spectator):
-        self.lock.acquire()
-        cookie = len(self.spectators)
-        self.spectators.append(spectator)
-        self.lock.release()
-        return cookie, self.state
+        if not self.classic:
+            raise CORBA.BAD_OPERATION(0, CORBA.COMPLETED_NO)
+
+        cookie, snapshot = self._spectatorGroup().watch(spectator)
+        return cookie, snapshot.state
+
+    @forwardHibernated
+    def watchVariant(self, spectator):
+        # Relays only speak GameState, so variant watchers are always
+        # notified directly.
+        cookie, snapshot = self._spectatorGroup().watch(spectator,
+                                                        relay=False)
+        return cookie, snapshot.packed
+
+    @forwardHibernated
+    def watchGameFrom(self, spectator, fromSeq):
+        if not self.classic:
+            raise CORBA.BAD_OPERATION(0, CORBA.COMPLETED_NO)
+
+        cookie, snapshot = self._spectatorGroup().watch(
+            spectator, relay=False,
+            replay=lambda snapshot: self._replay(snapshot, fromSeq))
+        return cookie, snapshot.state
+
+    @forwardHibernated
+    def watchVariantFrom(self, spectator, fromSeq):
+        cookie, snapshot = self._spectatorGroup().watch(
+            spectator, relay=False,
+            replay=lambda snapshot: self._replay(snapshot, fromSeq))
+        return cookie, snapshot.packed
+
+    def getMoves(self, fromSeq, maxMoves):
+        # The board's moves are only ever appended to, so a slice of
+        # them is a consistent snapshot, and needs no lock.
+        self.lastUsed = time.monotonic()
+        b = self.board
+        moves = b.moves[fromSeq:fromSeq + min(maxMoves, MOVE_PAGE_SIZE)]
+
+        return [TicTacToe.Move(seq, PLAYER_TYPES[board.NOUGHT if seq % 2 == 0
+                                                 else board.CROSS],
+                               *divmod(i, b.cols))
+                for seq, i in enumerate(moves, fromSeq)]
 
     def unwatchGame(self, cookie):
-        cookie = int(cookie)
-        self.lock.acquire()
-        if len(self.spectators) > cookie:
-            self.spectators[cookie] = None
-        self.lock.release()
+        if self.spectators is not None:
+            self.spectators.unwatch(int(cookie))
 
+    @forwardHibernated
     def kill(self):
-        self.factory._removeGame(self.name)
+        with self.moveLock:
+            self._touch()
+            self.factory._removeGame(self.name)
+
+        self._abort()
+
+    def _abort(self):
+        """Tell the players and spectators that the game has been
+        aborted, and deactivate it. The game must already have been
+        removed from the factory."""
+
+        with self.moveLock:
+            self.whose_go = board.NOBODY
+            if self.spectators is not None:
+                self.spectators.notifier.gameAborted()
 
         if self.p_noughts:
             try:
@@ -195,206 +1016,870 @@ class Game_i(TicTacToe__POA.Game):
             except CORBA.SystemException as ex:
                 print("System exception contacting crosses player")
 
-        self.spectatorNotifier.gameAborted()
-
-        self.poa.destroy(1, 0)
+        self._deactivate()
 
         print("Game killed")
 
-    def _play(self, x, y, ptype):
-        x = int(x)
-        y = int(y)
-        """Real implementation of GameController::play()"""
-        if self.whose_go != ptype:
-            raise TicTacToe.GameController.NotYourGo()
+    @forwardHibernated
+    def _play(self, row, col, ptype):
+        """Real implementation of GameController::play() and
+        VariantController::playAt(). Returns the GameSnapshot
+        published by the move."""
 
-        if x < 0 or x > 2 or y < 0 or y > 2:
-            raise TicTacToe.GameController.InvalidCoordinates()
+        with self.moveLock:
+            self._touch()
+            if self.whose_go != ptype:
+                raise TicTacToe.GameController.NotYourGo()
 
-        if self.state[x][y] != TicTacToe.Nobody:
-            raise TicTacToe.GameController.SquareOccupied()
+            try:
+                w = self.board.place(row, col, ptype)
 
-        self.state[x][y] = ptype
+            except board.InvalidCoordinates:
+                raise TicTacToe.GameController.InvalidCoordinates()
 
-        w = self._checkForWinner()
+            except board.SquareOccupied:
+                raise TicTacToe.GameController.SquareOccupied()
+
+            if w is not None:
+                self.whose_go = board.NOBODY
+            elif ptype == board.NOUGHT:
+                self.whose_go = board.CROSS
+                opponent = self.p_crosses
+            else:
+                self.whose_go = board.NOUGHT
+                opponent = self.p_noughts
+
+            snapshot = self._publish()
+
+            if self.spectators is not None:
+                if w is not None:
+                    self.spectators.notifier.end(
+                        self._callbackState(snapshot), PLAYER_TYPES[w])
+                else:
+                    self.spectators.notifier.up(self._callbackState(snapshot))
 
         try:
             if w is not None:
                 print("Winner:", w)
-                self.p_noughts.end(self.state, w)
-                self.p_crosses.end(self.state, w)
-                self.spectatorNotifier.end(self.state, w)
+                self._journal(w)
+
+                self._end(self.p_noughts, snapshot, w)
+                self._end(self.p_crosses, snapshot, w)
 
                 # Kill ourselves
                 self.factory._removeGame(self.name)
-                self.poa.destroy(1, 0)
+                self._deactivate()
             else:
 
                 # Tell opponent it's their go
-                if ptype == TicTacToe.Nought:
-                    self.whose_go = TicTacToe.Cross
-                    self.p_crosses.yourGo(self.state)
-                else:
-                    self.whose_go = TicTacToe.Nought
-                    self.p_noughts.yourGo(self.state)
-
-                s = (self.state[0][:], self.state[1][:], self.state[2][:])
-                self.spectatorNotifier.queue.put(("update", (s,)))
-
-                # self.spectatorNotifier.up(self.state)
+                self._yourGo(opponent, snapshot)
 
         except (CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST) as ex:
             print("Lost contact with player!")
             self.kill()
 
-        return self.state
-
-    def _checkForWinner(self):
-        """If there is a winner, return the winning player's type. If
-        the game is a tie, return Nobody, otherwise return None."""
-
-        # Rows
-        for i in range(3):
-            if self.state[i][0] == self.state[i][1] and \
-                    self.state[i][1] == self.state[i][2] and \
-                    self.state[i][0] != TicTacToe.Nobody:
-                return self.state[i][0]
-
-        # Columns
-        for i in range(3):
-            if self.state[0][i] == self.state[1][i] and \
-                    self.state[1][i] == self.state[2][i] and \
-                    self.state[0][i] != TicTacToe.Nobody:
-                return self.state[0][i]
-
-        # Top-left to bottom-right
-        if self.state[0][0] == self.state[1][1] and \
-                self.state[1][1] == self.state[2][2] and \
-                self.state[0][0] != TicTacToe.Nobody:
-            return self.state[0][0]
-
-        # Bottom-left to top-right
-        if self.state[0][2] == self.state[1][1] and \
-                self.state[1][1] == self.state[2][0] and \
-                self.state[0][2] != TicTacToe.Nobody:
-            return self.state[0][2]
-
-        # Return None if the game is not full
-        for i in range(3):
-            for j in range(3):
-                if self.state[i][j] == TicTacToe.Nobody:
-                    return None
-
-        # It's a draw
-        return TicTacToe.Nobody
-
-class SpectatorNotifier(threading.Thread):
-
-    # This thread is used to notify all the spectators about changes
-    # in the game state. Since there is only one thread, one errant
-    # spectator can hold up all the others. A proper event or
-    # notification service should make more effort to contact clients
-    # concurrently. No matter what happens, the players can't be held
-    # up.
-    #
-    # The implementation uses a simple work queue, which could
-    # potentially get backed-up. Ideally, items on the queue should be
-    # thrown out if they have been waiting too long.
-
-    def __init__(self, spectators, lock):
-        threading.Thread.__init__(self)
-        self.setDaemon(1)
-        self.spectators = spectators
-        self.lock = lock
-        self.queue = Queue.Queue(0)
-        self.start()
-
-    def apply(func, args, kwargs=None):
-        return func(*args) if kwargs is None else func(*args, **kwargs)
-
-    def run(self):
-        print("SpectatorNotifier running...")
-
-        while 1:
-            method, args = self.queue.get()
+        return snapshot
 
-            print("Notifying:", method)
+    def _journal(self, winner):
+        """Record the finished game in the server's journal, if it is
+        keeping one. A journal that can't be written to mustn't stop
+        the game from ending, so errors are only reported."""
 
+        if self.factory.journal:
+            try:
+                self.factory.journal.record(self.board, winner)
+            except (OSError, struct.error) as ex:
+                print("Cannot record game in journal:", ex)
+
+    def _publish(self):
+        """Publish a snapshot of the current state for lock-free readers.
+        Called with self.moveLock held, or before the game is shared."""
+
+        packed = self.board.packed()
+        state = classicState(packed) if self.classic else None
+
+        self.snapshot = GameSnapshot(self.players, state, packed)
+        return self.snapshot
+
+    def _touch(self):
+        """Note a request that changes the game. Called with
+        self.moveLock held."""
+
+        if self.hibernated:
+            raise Hibernated()
+        self.lastUsed = time.monotonic()
+
+    def _reactivated(self):
+        """Return the servant that replaced this one when the game was
+        hibernated, bringing the game back if need be."""
+
+        game = self.factory.hibernator.reactivate(self.name, self.serial)
+        if game is None:
+            raise CORBA.OBJECT_NOT_EXIST(0, CORBA.COMPLETED_NO)
+        return game
+
+    def _replay(self, snapshot, fromSeq):
+        """Return the callback states after each move from fromSeq to
+        the last move in snapshot, or the last MAX_REPLAY of them.
+        Called with self.moveLock held, so only the moves are copied
+        here; the states are built as the notifier sends them."""
+
+        made = len(self.board.moves)
+        first = max(fromSeq, made - MAX_REPLAY)
+        return replayStates(snapshot.packed, self.board.moves[first:made],
+                            first, self.classic)
+
+    def _spectatorGroup(self):
+        with self.moveLock:
+            self._touch()
+            if self.spectators is None:
+                self.spectators = SpectatorGroup(
+                    self.name, self.factory if self.classic else None,
+                    self.moveLock, lambda: self.snapshot,
+                    packed=not self.classic)
+            return self.spectators
+
+    def _deactivate(self):
+        """Deactivate the game and its controllers."""
+
+        poa = self.factory.game_poa
+        ids = [gameId(self.name, self.serial)]
+        ids += [controllerId(self.name, self.serial, ptype)
+                for ptype in (board.NOUGHT, board.CROSS)[:self.players]]
+
+        for id in ids:
             try:
-                self.lock.acquire()
-                for i in range(len(self.spectators)):
-                    spec = self.spectators[i]
-                    if spec:
-                        try:
-                            self.apply(getattr(spec, method), args)
-                        except (CORBA.COMM_FAILURE,
-                                CORBA.OBJECT_NOT_EXIST) as ex:
-                            print("Spectator lost")
-                            self.spectators[i] = None
-            finally:
-                self.lock.release()
+                poa.deactivate_object(id)
+            except PortableServer.POA.ObjectNotActive:
+                pass
 
-    def up(self, state):
-        s = (state[0][:], state[1][:], state[2][:])
-        self.queue.put(("update", (s,)))
+    def _yourGo(self, player, snapshot):
+        if self.classic:
+            player.yourGo(snapshot.state)
+        else:
+            player.yourGoPacked(snapshot.packed)
 
-    def end(self, state, winner):
-        self.queue.put(("end", (state, winner)))
+    def _end(self, player, snapshot, winner):
+        if self.classic:
+            player.end(snapshot.state, PLAYER_TYPES[winner])
+        else:
+            player.endPacked(snapshot.packed, PLAYER_TYPES[winner])
 
-    def gameAborted(self):
-        self.queue.put(("gameAborted", ()))
+    def _callbackState(self, snapshot):
+        if self.classic:
+            return snapshot.state
+        return snapshot.packed
 
 
-class GameController_i(TicTacToe__POA.GameController):
+class GameController_i(TicTacToe__POA.VariantController):
+    __slots__ = ("game", "ptype")
+
     def __init__(self, game, ptype):
         self.game = game
         self.ptype = ptype
-        print("GameController_i created.")
+        if game is not None:
+            print("GameController_i created.")
 
     def play(self, x, y):
+        if not self.game.classic:
+            raise CORBA.BAD_OPERATION(0, CORBA.COMPLETED_NO)
 
-        return self.game._play(x, y, self.ptype)
+        return self.game._play(int(x), int(y), self.ptype).state
 
+    def playAt(self, row, col):
+        return self.game._play(row, col, self.ptype).packed
 
-class SpectatorNotifier(threading.Thread):
-    def __init__(self, spectators, lock):
-        super().__init__()
-        self.setDaemon(True)
-        self.spectators = spectators
-        self.lock = lock
-        self.queue = Queue(0)
-        self.start()
+
+class SpectatorGroup:
+    """The spectators of one game, or of one relay. Watchers are
+    called directly by the group's SpectatorNotifier until there are
+    RELAY_THRESHOLD of them. After that, new watchers are handed to
+    relays obtained from the relay source, which each register with
+    the group as a single spectator. Since relays use a SpectatorGroup
+    of their own, they can be chained into a tree.
+
+    The registry of directly called spectators belongs to the notifier
+    thread. Registrations are queued to it while holding stateLock,
+    the lock under which the owner publishes new states, so a new
+    spectator receives exactly the notifications that follow the
+    state returned to it by watch()."""
+
+    def __init__(self, name, relaySource, stateLock, currentState,
+                 finished=None, packed=False):
+        self.name = name
+        self.relaySource = relaySource
+        self.stateLock = stateLock
+        self.currentState = currentState
+        self.finished = finished
+        self.lock = threading.Lock()
+        self.count = 0        # Spectators called directly, relays included
+        self.relays = {}      # cookie -> SpectatorRelay called directly
+        self.relayed = {}     # cookie -> (SpectatorRelay, relay's cookie)
+        self.nextCookie = 0
+        self.nextRelay = 0
+        self.notifier = SpectatorNotifier(self, packed)
+
+    def watch(self, spectator, relay=True, replay=None):
+        """Register a spectator. Returns its cookie, and the snapshot
+        it starts from. Unless relay is False, the spectator may be
+        handed to a relay. If replay is given, replay(snapshot) returns
+        states the spectator is sent before any later notification.
+        It is called with stateLock held, so it should only capture
+        what it needs; the notifier iterates over the states."""
+
+        with self.lock:
+            cookie = self._newCookie()
+            local = not relay or self.relaySource is None or \
+                self.count < RELAY_THRESHOLD
+            if local:
+                self.count += 1
+
+        if not local:
+            relay = self._chooseRelay()
+
+            if relay is not None:
+                try:
+                    rcookie, state = relay.watch(spectator)
+                    with self.lock:
+                        self.relayed[cookie] = (relay, rcookie)
+                    return cookie, GameSnapshot(None, state, None)
+
+                except (CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST):
+                    print("Relay lost")
+                    self._removeRelay(relay)
+
+            # No relay available, so we have to notify this one ourselves
+            with self.lock:
+                self.count += 1
+
+        return cookie, self._register(cookie, spectator, replay=replay)
+
+    def unwatch(self, cookie):
+        with self.lock:
+            entry = self.relayed.pop(cookie, None)
+
+        if entry is None:
+            self.notifier.unregister(cookie)
+            return
+
+        relay, rcookie = entry
+        try:
+            relay.unwatch(rcookie)
+        except CORBA.SystemException:
+            print("System exception contacting relay")
+
+    def _register(self, cookie, spectator, resync=False, replay=None):
+        with self.stateLock:
+            current = self.currentState()
+            if replay is not None:
+                states = replay(current)
+            elif resync:
+                states = (current.state,)
+            else:
+                states = ()
+            self.notifier.register(cookie, spectator, states)
+        return current
+
+    def _newCookie(self):
+        cookie = self.nextCookie
+        self.nextCookie += 1
+        return cookie
+
+    def _chooseRelay(self):
+        """Return the relay a new watcher should be handed to, creating
+        a new relay if the group has fewer than RELAY_FANOUT of them."""
+
+        with self.lock:
+            if len(self.relays) >= RELAY_FANOUT:
+                return self._nextRelay()
+
+        host = self.relaySource._relayHost()
+
+        if host is not None:
+            try:
+                relay = host.relayGame(self.name, self.currentState().state)
+                with self.lock:
+                    cookie = self._newCookie()
+                    self.count += 1
+                    self.relays[cookie] = relay
+
+                # The game may have moved on while the relay was being
+                # created, so it is brought up to date as it registers.
+                self._register(cookie, relay, resync=True)
+                print("Relay added for", self.name)
+                return relay
+
+            except (CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST):
+                print("Relay host lost")
+                self.relaySource._relayHostLost(host)
+
+        with self.lock:
+            if self.relays:
+                return self._nextRelay()
+
+        return None
+
+    def _nextRelay(self):
+        relays = list(self.relays.values())
+        relay = relays[self.nextRelay % len(relays)]
+        self.nextRelay += 1
+        return relay
+
+    def _removeRelay(self, relay):
+        with self.lock:
+            cookies = [c for c, r in self.relays.items() if r is relay]
+
+        for cookie in cookies:
+            self.notifier.unregister(cookie)
+
+    def _forget(self, cookie):
+        """Called by the notifier when a spectator leaves its registry."""
+        with self.lock:
+            self.count -= 1
+            self.relays.pop(cookie, None)
+
+
+class NotificationBudget:
+    """Global bound on the number of notifications queued across all
+    games, together with the cumulative counters reported by
+    GameFactory::notifierStats()."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.depth = 0
+        self.dropped = 0
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.queues = weakref.WeakSet()
+
+    def acquire(self):
+        with self.lock:
+            if self.depth >= self.limit:
+                return False
+            self.depth += 1
+            return True
+
+    def force(self):
+        with self.lock:
+            self.depth += 1
+
+    def release(self):
+        with self.lock:
+            self.depth -= 1
+
+    def count(self, what):
+        with self.lock:
+            setattr(self, what, getattr(self, what) + 1)
+
+    def addQueue(self, queue):
+        with self.lock:
+            self.queues.add(queue)
+
+    def allQueues(self):
+        """Return a list of the queues, which other threads may be
+        adding to."""
+
+        with self.lock:
+            return list(self.queues)
+
+
+class NotificationQueue:
+    """Bounded FIFO of (method, args) notifications for one game. Each
+    item is stamped when it is queued, and updates that have waited
+    longer than NOTIFY_MAX_AGE are thrown away rather than delivered.
+    When the queue, or the global budget, is full, room is made
+    according to the overflow policy:
+
+      drop-oldest   discard the oldest queued update.
+      drop-updates  discard every queued update. Each update carries
+                    the whole game state, so the new one supersedes
+                    them.
+      evict-slow    discard the oldest queued update, and ask the
+                    notifier to evict the spectators holding it up.
+
+    The end and gameAborted notifications, and spectator
+    registrations, are never dropped. Once the queue has been closed,
+    nothing more is queued."""
+
+    def __init__(self, name, budget, maxsize=None, policy=None, maxAge=None):
+        self.name = name
+        self.budget = budget
+        self.maxsize = NOTIFY_QUEUE_SIZE if maxsize is None else maxsize
+        self.policy = NOTIFY_POLICY if policy is None else policy
+        self.maxAge = NOTIFY_MAX_AGE if maxAge is None else maxAge
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.expired = 0
+        self.evicted = 0
+        self.evictPending = False
+        self.closed = False
+        budget.addQueue(self)
+
+    def put(self, item):
+        """Queue an item, returning False if it was dropped, or the
+        queue is closed."""
+
+        method, args = item
+        kept = method in KEPT_NOTIFICATIONS
+
+        with self.lock:
+            if self.closed:
+                return False
+            elif len(self.items) < self.maxsize and self.budget.acquire():
+                pass
+            elif self._makeRoom():
+                # The new item takes over the slot of a discarded one
+                pass
+            elif kept:
+                self.budget.force()
+            else:
+                self._drop()
+                return False
+
+            self.items.append((time.monotonic(), method, args))
+            return True
+
+    def get(self):
+        """Return the next (method, args) to deliver, or None if there
+        are none."""
+
+        with self.lock:
+            while self.items:
+                stamp, method, args = self.items.popleft()
+                self.budget.release()
+
+                if method in KEPT_NOTIFICATIONS or \
+                        time.monotonic() - stamp <= self.maxAge:
+                    return method, args
+
+                self.expired += 1
+                self.budget.count("expired")
+
+        return None
+
+    def qsize(self):
+        return len(self.items)
+
+    def close(self):
+        """Discard the queued items, returning their budget slots, and
+        refuse any more."""
+
+        with self.lock:
+            for i in range(len(self.items)):
+                self.budget.release()
+            self.items.clear()
+            self.closed = True
+
+    def _makeRoom(self):
+        """Discard queued updates according to the policy, keeping
+        exactly one budget slot for the caller. Returns False if there
+        was nothing that could be discarded."""
+
+        updates = [i for i, item in enumerate(self.items)
+                   if item[1] not in KEPT_NOTIFICATIONS]
+        if not updates:
+            return False
+
+        if self.policy == "drop-updates":
+            discard = updates
+        else:
+            discard = updates[:1]
+            if self.policy == "evict-slow":
+                self.evictPending = True
+
+        for i in reversed(discard):
+            del self.items[i]
+            self._drop()
+
+        # Keep one of the freed slots for the new item
+        for i in range(len(discard) - 1):
+            self.budget.release()
+
+        return True
+
+    def _drop(self):
+        self.dropped += 1
+        self.budget.count("dropped")
+
+
+class NotifierPool:
+    """Threads shared by the SpectatorNotifiers of every game. A notifier
+    with work queued is scheduled on the pool, and is only ever served
+    by one thread at a time, which delivers up to NOTIFY_BATCH of its
+    notifications before moving on. Each game's notifications are
+    still delivered in order, but a game with nothing to deliver costs
+    no thread at all. Threads are started as they are first needed."""
+
+    def __init__(self, size):
+        self.size = size
+        self.ready = collections.deque()
+        self.cond = threading.Condition(threading.Lock())
+        self.threads = []
+
+    def prestart(self):
+        """Start all the threads now, rather than as they are needed."""
+        with self.cond:
+            while len(self.threads) < self.size:
+                self._startThread()
+
+    def schedule(self, notifier):
+        with self.cond:
+            if notifier.scheduled:
+                return
+
+            notifier.scheduled = True
+            self.ready.append(notifier)
+
+            if len(self.threads) < self.size:
+                self._startThread()
+
+            self.cond.notify()
+
+    def _startThread(self):
+        t = threading.Thread(target=self.run, name="SpectatorNotifier")
+        t.setDaemon(True)
+        t.start()
+        self.threads.append(t)
 
     def run(self):
         print("SpectatorNotifier running...")
 
         while True:
-            method, args = self.queue.get()
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                notifier = self.ready.popleft()
+
+            try:
+                notifier.deliver(NOTIFY_BATCH)
+            except Exception:
+                # Neither the thread nor the game's other notifications
+                # may be lost to one failed delivery.
+                traceback.print_exc()
+
+            with self.cond:
+                if notifier.queue.qsize() and not notifier.done:
+                    self.ready.append(notifier)
+                    self.cond.notify()
+                else:
+                    notifier.scheduled = False
+
+
+class SpectatorNotifier:
+
+    # The notifier delivers changes in the game state to all the
+    # spectators, on the threads of the shared NotifierPool. Since a
+    # game's notifications are delivered one at a time, one errant
+    # spectator can hold up all the others, although the number of
+    # spectators it calls directly is bounded by RELAY_THRESHOLD plus
+    # RELAY_FANOUT once relays are available. No matter what happens,
+    # the players can't be held up. Since the pool's threads are
+    # shared, a hung spectator also holds up one thread's worth of
+    # other games, so calls to spectators time out after
+    # SPECTATOR_CALL_TIMEOUT, and a spectator whose call fails in any
+    # way is dropped.
+    #
+    # The work queue is bounded, both per game and globally, and
+    # updates that have waited too long are thrown out. See
+    # NotificationQueue for the overflow policies.
+    #
+    # Spectators are registered and unregistered through the same
+    # queue, and the registry is only touched while delivering, so
+    # nobody waits for the fan-out loop to finish.
+    #
+    # Delivery stops after an end or gameAborted notification, at
+    # which point the group's finished callback is run.
+
+    def __init__(self, group, packed=False):
+        self.group = group
+        self.packed = packed
+        self.queue = NotificationQueue(group.name, notificationBudget)
+        self.spectators = {} # cookie -> Spectator
+        self.callTimes = {}  # cookie -> duration of the last call
+        self.scheduled = False
+        self.done = False
+
+    def deliver(self, limit):
+        """Deliver up to limit queued notifications. Only ever called
+        by one pool thread at a time."""
+
+        group = self.group
+
+        for i in range(limit):
+            item = self.queue.get()
+            if item is None:
+                return
+
+            method, args = item
+
+            if method == "_register":
+                cookie, spec, states = args
+                if SPECTATOR_CALL_TIMEOUT:
+                    omniORB.setClientCallTimeout(
+                        spec, int(SPECTATOR_CALL_TIMEOUT * 1000))
+                self.spectators[cookie] = spec
+                update = "updatePacked" if self.packed else "update"
+                for state in states:
+                    if cookie not in self.spectators:
+                        break
+                    self._call(cookie, spec, update, (state,))
+                continue
+
+            if method == "_unregister":
+                if self.spectators.pop(args[0], None) is not None:
+                    self.callTimes.pop(args[0], None)
+                    group._forget(args[0])
+                continue
+
             print("Notifying:", method)
 
-            with self.lock:
-                for i, spec in enumerate(self.spectators):
-                    if spec:
-                        try:
-                            getattr(spec, method)(*args)
-                        except (CORBA.COMM_FAILURE, CORBA.OBJECT_NOT_EXIST):
-                            print("Spectator lost")
-                            self.spectators[i] = None
+            if self.queue.evictPending:
+                self._evictSlow()
+
+            for cookie, spec in list(self.spectators.items()):
+                self._call(cookie, spec, method, args)
+
+            if method in TERMINAL_NOTIFICATIONS:
+                self.done = True
+                self.queue.close()
+                if group.finished:
+                    group.finished()
+                return
+
+    def _call(self, cookie, spec, method, args):
+        start = time.monotonic()
+        try:
+            getattr(spec, method)(*args)
+        except CORBA.SystemException:
+            print("Spectator lost")
+            del self.spectators[cookie]
+            self.callTimes.pop(cookie, None)
+            self.group._forget(cookie)
+            return
+        self.callTimes[cookie] = time.monotonic() - start
+
+    def _evictSlow(self):
+        """Evict the spectators whose last call took longer than
+        SLOW_SPECTATOR_TIME, or failing that the slowest one. Relays
+        are never evicted."""
+
+        relays = self.group.relays
+        self.queue.evictPending = False
+
+        times = [(self.callTimes.get(cookie, 0.0), cookie)
+                 for cookie in self.spectators if cookie not in relays]
+        if not times:
+            return
+
+        slow = [cookie for t, cookie in times if t > SLOW_SPECTATOR_TIME]
+        if not slow:
+            slow = [max(times)[1]]
+
+        for cookie in slow:
+            print("Evicting slow spectator")
+            del self.spectators[cookie]
+            self.callTimes.pop(cookie, None)
+            self.group._forget(cookie)
+            self.queue.evicted += 1
+            notificationBudget.count("evicted")
+
+    def _put(self, item):
+        # The queue is closed when delivery stops, under the same lock
+        # as put(), so nothing queued afterwards can hold a slot of the
+        # global budget.
+        if self.queue.put(item):
+            notifierPool.schedule(self)
+
+    # States passed in are never modified afterwards, so they are
+    # queued without being copied.
+    def up(self, state):
+        if self.packed:
+            self._put(("updatePacked", (state,)))
+        else:
+            self._put(("update", (state,)))
+
+    def end(self, state, winner):
+        if self.packed:
+            self._put(("endPacked", (state, winner)))
+        else:
+            self._put(("end", (state, winner)))
+
+    def gameAborted(self):
+        self._put(("gameAborted", ()))
+
+    def register(self, cookie, spectator, states=()):
+        self._put(("_register", (cookie, spectator, states)))
+
+    def unregister(self, cookie):
+        self._put(("_unregister", (cookie,)))
+
+
+notificationBudget = NotificationBudget(NOTIFY_GLOBAL_SIZE)
+notifierPool = NotifierPool(NOTIFIER_THREADS)
+teardownPool = concurrent.futures.ThreadPoolExecutor(
+    TEARDOWN_THREADS, thread_name_prefix="GameTeardown")
+
+
+def configure(settings):
+    """Apply server settings, given as a dict of lower-case SETTINGS
+    names to values, converting each to the type of its default. Must
+    be called before the factory is created."""
+
+    global teardownPool
+
+    module = globals()
+    for key, value in settings.items():
+        name = key.upper()
+        if name not in SETTINGS:
+            raise ValueError("unknown server setting " + key)
+        module[name] = type(module[name])(value)
+
+    if NOTIFY_POLICY not in ("drop-oldest", "drop-updates", "evict-slow"):
+        raise ValueError("unknown notify_policy " + NOTIFY_POLICY)
+
+    notificationBudget.limit = NOTIFY_GLOBAL_SIZE
+    notifierPool.size = NOTIFIER_THREADS
+    teardownPool = concurrent.futures.ThreadPoolExecutor(
+        TEARDOWN_THREADS, thread_name_prefix="GameTeardown")
+
+
+def instrumentUpcalls(tracer):
+    """Trace the upcalls we care about, and notifier deliveries."""
+
+    def game(obj, args):
+        return {"game": obj.name}
+
+    tracer.instrument(GameFactory_i, "listGames", "listGames",
+                      lambda obj, args: {})
+    tracer.instrument(Game_i, "_join", "joinGame", game)
+    tracer.instrument(Game_i, "_yourGo", "yourGo callback", game)
+    tracer.instrument(Game_i, "_end", "end callback", game)
+    tracer.instrument(GameController_i, "play", "play",
+                      lambda obj, args: {"game": obj.game.name})
+    tracer.instrument(GameController_i, "playAt", "play",
+                      lambda obj, args: {"game": obj.game.name})
+    tracer.instrument(SpectatorNotifier, "_call", "notify",
+                      lambda obj, args: {"game": obj.group.name,
+                                         "method": args[2]})
 
 
 def main(argv):
+    started = time.perf_counter()
     print("Game Server starting...")
 
-    orb = CORBA.ORB_init(argv, CORBA.ORB_ID)
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument("--config", metavar="FILE",
+                        help="read ORB and server settings from FILE")
+    parser.add_argument("--no-naming", action="store_true",
+                        help="don't register with the naming service")
+    parser.add_argument("--ior-file", metavar="FILE",
+                        help="write the GameFactory's IOR to FILE")
+    parser.add_argument("--journal", metavar="DIR",
+                        help="record completed games in journals in DIR")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="sample all thread stacks, writing folded "
+                        "stacks for a flame graph to FILE")
+    parser.add_argument("--profile-interval", metavar="SECS", type=float,
+                        default=0.005, help="seconds between samples")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write trace spans for upcalls and "
+                        "notifications to FILE")
+    parser.add_argument("--trace-rate", metavar="RATE", type=float,
+                        default=0.01, help="fraction of calls traced")
+    parser.add_argument("--hibernate", metavar="STORE",
+                        help="hibernate idle games to a game store at STORE")
+    parser.add_argument("--idle-time", metavar="SECS", type=float,
+                        help="seconds before an idle game is hibernated")
+    parser.add_argument("--max-resident", metavar="GAMES", type=int,
+                        help="most games kept in memory")
+    parser.add_argument("--pool-size", metavar="GAMES", type=int,
+                        help="ready-made games kept for newGame(), or 0 "
+                        "to start everything lazily")
+
+    # The -ORB options are left for ORB_init(), after those from the
+    # configuration file, so that they override it.
+    args, rest = parser.parse_known_args(argv[1:])
+
+    orbArgs = []
+    if args.config:
+        try:
+            config = serverConfig.ServerConfig.load(args.config)
+            configure(config.server)
+        except (OSError, ValueError) as ex:
+            parser.error(str(ex))
+        orbArgs = config.orbArgs()
+        print("Configuration:", config.describe())
+
+    orbArgv = argv[:1] + orbArgs + rest
+    t = time.perf_counter()
+    orb = CORBA.ORB_init(orbArgv, CORBA.ORB_ID)
+    if len(orbArgv) > 1:
+        parser.error("unrecognized arguments: " + " ".join(orbArgv[1:]))
+
     poa = orb.resolve_initial_references("RootPOA")
     poa._get_the_POAManager().activate()
-
-    gf_impl = GameFactory_i(poa)
+    orbTime = time.perf_counter() - t
+
+    sampler = tracer = None
+
+    if args.profile:
+        sampler = profiling.StackSampler(args.profile, args.profile_interval)
+        sampler.start()
+
+    if args.trace:
+        tracer = profiling.Tracer(args.trace, args.trace_rate)
+        instrumentUpcalls(tracer)
+        print("Tracing %g of calls to %s" % (args.trace_rate, args.trace))
+
+    t = time.perf_counter()
+    gf_impl = GameFactory_i(poa, args.pool_size, started)
+    if gf_impl.pool.size:
+        notifierPool.prestart()
+    factoryTime = time.perf_counter() - t
+
+    if args.journal:
+        gf_impl.journal = gameJournal.JournalWriter(args.journal)
+        print("Recording games in", args.journal)
+    if args.hibernate:
+        gf_impl.hibernator = GameHibernator(
+            gf_impl, orb, gameStore.GameStore(args.hibernate),
+            args.idle_time, args.max_resident)
+        print("Hibernating idle games to", args.hibernate)
     gf_id = poa.activate_object(gf_impl)
     gf_obj = poa.id_to_reference(gf_id)
 
-    print(orb.object_to_string(gf_obj))
+    ior = orb.object_to_string(gf_obj)
+    print(ior)
+
+    if args.ior_file:
+        # Written whole, so that nobody waiting for it reads half of it
+        tmp = args.ior_file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(ior)
+        os.replace(tmp, args.ior_file)
+
+    t = time.perf_counter()
+    if not args.no_naming:
+        bindFactory(orb, gf_obj)
+    namingTime = time.perf_counter() - t
+
+    print("Started in %.3f s: ORB %.3f s, factory and %d pooled games "
+          "%.3f s, naming service %.3f s" %
+          (time.perf_counter() - started, orbTime, gf_impl.pool.size,
+           factoryTime, namingTime))
 
+    try:
+        orb.run()
+    finally:
+        if sampler:
+            sampler.stop()
+        if tracer:
+            tracer.close()
+
+
+def bindFactory(orb, gf_obj):
     try:
         nameRoot = orb.string_to_object("IOR:010000002b00000049444c3a6f6d672e6f72672f436f734e616d696e672f4e616d696e67436f6e746578744578743a312e300000010000000000000070000000010102000e0000003139322e3136382e312e31303500f90a0b0000004e616d6553657276696365000300000000000000080000000100000000545441010000001c0000000100000001000100010000000100010509010100010000000901010003545441080000009c9b546701006a14")
 
@@ -421,8 +1906,6 @@ def main(argv):
     tutorialContext.rebind([CosNaming.NameComponent("GameFactory", "")], gf_obj)
     print("GameFactory bound in NameService.")
 
-    orb.run()
-
 
 if __name__ == "__main__":
     main(sys.argv)
\ No newline at end of file
@@ -0,0 +1,117 @@
+# gameStore.py
+
+"""Local store of hibernated games, used by the game server to keep idle
+games out of memory. Each game is kept under its name as a compact
+record:
+
+  uint16 x 3   rows, cols, k
+  uint8        players joined
+  uint64       serial number of the game's object ids
+  uint32       number of moves
+  float64      when the game was last used, by the server's
+               monotonic clock
+  uint16[]     squares played, in order, as indexes into the board
+               row by row
+  uint32, str  noughts player's IOR, length-prefixed, empty if none
+  uint32, str  crosses player's IOR, likewise
+
+The board itself isn't stored, since replaying the moves rebuilds it.
+Everything is little-endian. The store is a dbm database, rewritten
+from scratch each time the server starts."""
+
+import dbm
+import struct
+import threading
+import board
+
+HEAD = struct.Struct("<HHHBQId")
+LENGTH = struct.Struct("<I")
+
+
+def encodeGame(b, players, serial, iors, lastUsed):
+    """Encode a game in progress on board b, with iors the stringified
+    references of its players (or None), noughts first."""
+
+    parts = [HEAD.pack(b.rows, b.cols, b.k, players, serial, len(b.moves),
+                       lastUsed),
+             struct.pack("<%dH" % len(b.moves), *b.moves)]
+
+    for ior in iors:
+        ior = (ior or "").encode("ascii")
+        parts.append(LENGTH.pack(len(ior)))
+        parts.append(ior)
+
+    return b"".join(parts)
+
+
+def decodeGame(data):
+    """Return (board, players, serial, iors) from an encoded game."""
+
+    rows, cols, k, players, serial, nmoves, lastUsed = \
+        HEAD.unpack_from(data)
+    offset = HEAD.size
+    moves = struct.unpack_from("<%dH" % nmoves, data, offset)
+    offset += 2 * nmoves
+
+    b = board.Board(rows, cols, k)
+    for ply, i in enumerate(moves):
+        b.place(*divmod(i, cols),
+                board.NOUGHT if ply % 2 == 0 else board.CROSS)
+
+    iors = []
+    for p in range(2):
+        n, = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        iors.append(data[offset:offset + n].decode("ascii") or None)
+        offset += n
+
+    return b, players, serial, iors
+
+
+def peekGame(data):
+    """Return (players, lastUsed) from an encoded game, without
+    decoding the rest."""
+
+    rows, cols, k, players, serial, nmoves, lastUsed = \
+        HEAD.unpack_from(data)
+    return players, lastUsed
+
+
+class GameStore:
+    """Encoded games, by name. Thread safe."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = dbm.open(path, "n")
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def put(self, name, data):
+        key = name.encode("utf-8")
+        with self.lock:
+            if key not in self.db:
+                self.count += 1
+            self.db[key] = data
+
+    def get(self, name):
+        with self.lock:
+            return self.db.get(name.encode("utf-8"))
+
+    def take(self, name):
+        """Remove a game from the store and return it, or None if it
+        isn't there."""
+
+        key = name.encode("utf-8")
+        with self.lock:
+            data = self.db.get(key)
+            if data is not None:
+                del self.db[key]
+                self.count -= 1
+        return data
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,146 @@
+# profiling.py
+
+"""Opt-in profiling for the game server: a sampling profiler covering
+every thread, and trace spans around selected upcalls. Nothing here is
+installed unless the server is started with --profile or --trace, so
+the cost when they are off is nil.
+
+The profiler writes folded stacks, one "frame;frame;... count" line per
+distinct stack, rooted at the thread's name. That is the input format
+of flamegraph.pl, speedscope and most other flame graph tools.
+
+Spans are written in the Chrome trace event format, which can be
+loaded into chrome://tracing or Perfetto."""
+
+import functools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+# Seconds between rewrites of the profile while the server is running
+FLUSH_INTERVAL = 10
+
+
+def threadGroup(name):
+    """Strip the number from a thread name, so that, for example, all
+    the ORB's worker threads are folded together."""
+    return re.sub(r"[-_ ]?\d+( \(\w+\))?$", "", name) or name
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of every thread each interval seconds, and
+    writes the accumulated folded stacks to path."""
+
+    def __init__(self, path, interval=0.005):
+        super().__init__(name="StackSampler")
+        self.setDaemon(True)
+        self.path = path
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        print("Stack sampler running...")
+
+        flush = time.monotonic() + FLUSH_INTERVAL
+
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+            if time.monotonic() >= flush:
+                self.write()
+                flush = time.monotonic() + FLUSH_INTERVAL
+
+    def sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        counts = self.counts
+
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s)" % (code.co_name,
+                                          os.path.basename(code.co_filename)))
+                frame = frame.f_back
+
+            stack.append(threadGroup(names.get(ident, "thread")))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+
+        self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
+        print("Profile of %d samples written to %s" % (self.samples,
+                                                       self.path))
+
+    def write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write("%s %d\n" % (stack, count))
+        os.replace(tmp, self.path)
+
+
+class Tracer:
+    """Records a sample of calls to instrumented methods as complete
+    ("X") trace events. rate is the fraction of calls recorded."""
+
+    def __init__(self, path, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.epoch = time.perf_counter()
+        self.file = open(path, "w", buffering=1)
+
+        # The closing bracket is optional in the trace event format, so
+        # events can be appended as they happen.
+        self.file.write("[\n")
+
+    def instrument(self, cls, method, span, tag):
+        """Replace cls.method with a version that records a span named
+        span for a sample of calls, with args given by tag(self,
+        args)."""
+
+        original = getattr(cls, method)
+        rate = self.rate
+
+        @functools.wraps(original)
+        def traced(obj, *args):
+            if random.random() >= rate:
+                return original(obj, *args)
+
+            start = time.perf_counter()
+            try:
+                return original(obj, *args)
+            finally:
+                self.record(span, tag(obj, args), start,
+                            time.perf_counter() - start)
+
+        setattr(cls, method, traced)
+
+    def record(self, span, args, start, duration):
+        event = {"name": span,
+                 "ph": "X",
+                 "pid": os.getpid(),
+                 "tid": threading.get_ident(),
+                 "ts": round((start - self.epoch) * 1e6, 1),
+                 "dur": round(duration * 1e6, 1),
+                 "args": args}
+        line = json.dumps(event) + ",\n"
+
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
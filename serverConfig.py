@@ -0,0 +1,98 @@
+# serverConfig.py
+
+"""Configuration files for the game server, given to it with --config.
+A file has up to two sections:
+
+  [orb]     omniORB parameters, passed to ORB_init() as -ORB options.
+            model = connection or pool is shorthand for
+            threadPerConnectionPolicy = 1 or 0.
+  [server]  the game server's own settings, named after the constants
+            in gameServer.SETTINGS, in lower case.
+
+For example:
+
+  [orb]
+  model = pool
+  maxServerThreadPoolSize = 64
+  maxGIOPConnectionPerServer = 10
+  threadPerConnectionUpperLimit = 2000
+
+  [server]
+  notifier_threads = 16
+  notify_queue_size = 64
+  scavenger_interval = 60
+
+The omniORB parameters that matter most for the game server are the
+threading model and thread pool size, the connection limits
+(threadPerConnectionUpperLimit and LowerLimit, maxGIOPConnectionPerServer
+for callbacks to players and spectators) and the connection scan
+periods (inConScanPeriod, outConScanPeriod). Options given on the
+command line override the file."""
+
+import configparser
+
+SECTIONS = ("orb", "server")
+
+# Values of the model shorthand
+MODELS = {"connection": "1", "pool": "0"}
+
+
+class ServerConfig:
+    def __init__(self, orb=None, server=None):
+        self.orb = dict(orb or {})
+        self.server = dict(server or {})
+
+    @classmethod
+    def load(cls, path):
+        parser = cls._parser()
+        try:
+            with open(path) as f:
+                parser.read_file(f)
+        except configparser.Error as ex:
+            raise ValueError("%s: %s" % (path, ex))
+
+        for section in parser.sections():
+            if section not in SECTIONS:
+                raise ValueError("%s: unknown section [%s]" % (path, section))
+
+        orb = {}
+        server = {}
+        if parser.has_section("orb"):
+            orb = dict(parser.items("orb"))
+        if parser.has_section("server"):
+            server = {k.lower(): v for k, v in parser.items("server")}
+
+        if orb.get("model", "connection") not in MODELS:
+            raise ValueError("%s: model must be one of %s" %
+                             (path, ", ".join(MODELS)))
+
+        return cls(orb, server)
+
+    def write(self, path):
+        parser = self._parser()
+        parser["orb"] = self.orb
+        parser["server"] = self.server
+        with open(path, "w") as f:
+            parser.write(f)
+
+    def orbArgs(self):
+        """Return the [orb] section as ORB_init() arguments."""
+
+        args = []
+        for name, value in self.orb.items():
+            if name == "model":
+                name, value = "threadPerConnectionPolicy", MODELS[value]
+            args += ["-ORB" + name, str(value)]
+        return args
+
+    def describe(self):
+        return " ".join("%s=%s" % item for item in
+                        list(self.orb.items()) + list(self.server.items()))
+
+    @staticmethod
+    def _parser():
+        parser = configparser.ConfigParser(interpolation=None)
+
+        # omniORB parameter names are case sensitive
+        parser.optionxform = str
+        return parser
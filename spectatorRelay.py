@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# spectatorRelay.py
+
+import sys
+import threading
+import CORBA
+import TicTacToe
+import TicTacToe__POA
+from gameServer import GameSnapshot, SpectatorGroup
+
+
+class RelayHost_i(TicTacToe__POA.RelayHost):
+    """Creates spectator relays on behalf of a GameFactory, or of an
+    upstream relay host. Relays created here hand their overflow
+    watchers to relays on the downstream hosts, if any, so that hosts
+    can be chained into a tree."""
+
+    def __init__(self, poa, downstream):
+        self.poa = poa
+        self.downstream = downstream
+        self.nextHost = 0
+        self.lock = threading.Lock()
+        print("RelayHost_i created.")
+
+    def relayGame(self, name, state):
+        relay = SpectatorRelay_i(self, name, state)
+        rid = self.poa.activate_object(relay)
+        return self.poa.id_to_reference(rid)
+
+    def _relayHost(self):
+        with self.lock:
+            if not self.downstream:
+                return None
+
+            host = self.downstream[self.nextHost % len(self.downstream)]
+            self.nextHost += 1
+            return host
+
+    def _relayHostLost(self, host):
+        with self.lock:
+            if host in self.downstream:
+                self.downstream.remove(host)
+
+    def _removeRelay(self, relay):
+        id = self.poa.servant_to_id(relay)
+        self.poa.deactivate_object(id)
+
+
+class SpectatorRelay_i(TicTacToe__POA.SpectatorRelay):
+    """Watches one game as a single Spectator and re-broadcasts its
+    notifications to downstream spectators. Notifications are queued
+    in the order they arrive, so the relay preserves the game's
+    delivery order, and it deactivates itself once the end or
+    gameAborted notification has been passed on."""
+
+    def __init__(self, host, name, state):
+        self.host = host
+        self.name = name
+        self.lock = threading.Lock()
+        self.snapshot = GameSnapshot(None, state, None)
+        self.spectators = SpectatorGroup(name, host, self.lock,
+                                         lambda: self.snapshot,
+                                         self._finished)
+        self.spectatorNotifier = self.spectators.notifier
+        print("SpectatorRelay_i created.")
+
+    # Spectator methods, called by the upstream notifier
+    def update(self, state):
+        with self.lock:
+            self.snapshot = GameSnapshot(None, state, None)
+            self.spectatorNotifier.up(state)
+
+    def end(self, state, winner):
+        with self.lock:
+            self.snapshot = GameSnapshot(None, state, None)
+            self.spectatorNotifier.end(state, winner)
+
+    def gameAborted(self):
+        self.spectatorNotifier.gameAborted()
+
+    # SpectatorRelay methods
+    def watch(self, spectator):
+        cookie, snapshot = self.spectators.watch(spectator)
+        return cookie, snapshot.state
+
+    def unwatch(self, cookie):
+        self.spectators.unwatch(int(cookie))
+
+    def _finished(self):
+        print("Relay for", self.name, "finished")
+        self.host._removeRelay(self)
+
+
+def main(argv):
+    print("Spectator relay starting...")
+
+    orb = CORBA.ORB_init(argv, CORBA.ORB_ID)
+    poa = orb.resolve_initial_references("RootPOA")
+    poa._get_the_POAManager().activate()
+
+    if len(argv) < 2:
+        print("Usage: %s <GameFactory IOR | -> [downstream RelayHost IOR ...]"
+              % argv[0])
+        sys.exit(1)
+
+    downstream = []
+    for ior in argv[2:]:
+        host = orb.string_to_object(ior)._narrow(TicTacToe.RelayHost)
+        if host is None:
+            print("Downstream object is not a RelayHost:", ior)
+            sys.exit(1)
+        downstream.append(host)
+
+    rh_impl = RelayHost_i(poa, downstream)
+    rh_id = poa.activate_object(rh_impl)
+    rh_obj = poa.id_to_reference(rh_id)
+
+    print(orb.object_to_string(rh_obj))
+
+    # A relay host given "-" instead of a factory only serves the
+    # upstream relay hosts that list it as downstream.
+    if argv[1] != "-":
+        try:
+            factory = orb.string_to_object(argv[1])
+            factory = factory._narrow(TicTacToe.GameFactory)
+            factory.registerRelayHost(rh_obj)
+            print("Relay host registered with GameFactory.")
+
+        except CORBA.SystemException as ex:
+            print("System exception registering with GameFactory:")
+            print("  ", CORBA.id(ex), ex)
+            sys.exit(1)
+
+    orb.run()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# tournament.py
+
+"""In-process bot tournaments. Games are played directly on board.Board,
+the rules engine behind Game_i, with no ORB involved, and are spread
+across a pool of worker processes. Every ordered pairing of the chosen
+bots plays the given number of games; the outcome of each pairing and
+the overall games per second are reported, and the games can be
+written to a journal for gameAnalytics.py.
+
+  tournament.py [-b random,heuristic,perfect] [-n games] [--board 3x3x3]
+                [-p processes] [-o journal]
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+import board
+import gameJournal
+
+# Games handed to a worker process at a time
+CHUNK = 5000
+
+# Largest board PerfectBot searches; it plays as HeuristicBot on others
+PERFECT_MAX_SQUARES = 9
+
+
+def emptySquares(b):
+    return [i for i, c in enumerate(b.cells) if c == board.NOBODY]
+
+
+def wouldWin(b, i, ptype):
+    """Return True if ptype playing square i would win."""
+    b.cells[i] = ptype
+    try:
+        return b.winsAt(*divmod(i, b.cols))
+    finally:
+        b.cells[i] = board.NOBODY
+
+
+class RandomBot:
+    def move(self, b, ptype, rng):
+        return rng.choice(emptySquares(b))
+
+
+class HeuristicBot:
+    """Wins if it can, blocks if it must, and otherwise prefers the
+    squares nearest the centre."""
+
+    def move(self, b, ptype, rng):
+        empty = emptySquares(b)
+        other = board.CROSS if ptype == board.NOUGHT else board.NOUGHT
+
+        for who in (ptype, other):
+            for i in empty:
+                if wouldWin(b, i, who):
+                    return i
+
+        crow = (b.rows - 1) / 2.0
+        ccol = (b.cols - 1) / 2.0
+
+        def distance(i):
+            row, col = divmod(i, b.cols)
+            return max(abs(row - crow), abs(col - ccol))
+
+        best = min(distance(i) for i in empty)
+        return rng.choice([i for i in empty if distance(i) == best])
+
+
+class PerfectBot:
+    """Plays a move of the best outcome found by exhaustive search,
+    choosing at random between equally good ones. Positions are
+    scored once per process and cached."""
+
+    cache = {}
+
+    def __init__(self):
+        self.fallback = HeuristicBot()
+
+    def move(self, b, ptype, rng):
+        if len(b.cells) > PERFECT_MAX_SQUARES:
+            return self.fallback.move(b, ptype, rng)
+
+        scores = [(self._score(b, i, ptype), i) for i in emptySquares(b)]
+        best = max(s for s, i in scores)
+        return rng.choice([i for s, i in scores if s == best])
+
+    def _score(self, b, i, ptype):
+        """Score ptype playing square i: 1 for a win, 0 for a draw, -1
+        for a loss, assuming best play from then on."""
+
+        key = (bytes(b.cells), i, ptype)
+        score = self.cache.get(key)
+        if score is not None:
+            return score
+
+        b.cells[i] = ptype
+        b.filled += 1
+        try:
+            if b.winsAt(*divmod(i, b.cols)):
+                score = 1
+            elif b.filled == len(b.cells):
+                score = 0
+            else:
+                other = board.CROSS if ptype == board.NOUGHT else board.NOUGHT
+                score = -max(self._score(b, j, other) for j in emptySquares(b))
+        finally:
+            b.cells[i] = board.NOBODY
+            b.filled -= 1
+
+        self.cache[key] = score
+        return score
+
+
+BOTS = {
+    "random": RandomBot,
+    "heuristic": HeuristicBot,
+    "perfect": PerfectBot,
+}
+
+
+def playGame(spec, noughts, crosses, rng):
+    """Play one game between two bots, returning the finished board
+    and the winner."""
+
+    b = board.Board(*spec)
+    players = ((board.NOUGHT, noughts), (board.CROSS, crosses))
+
+    for ply in itertools.count():
+        ptype, bot = players[ply % 2]
+        row, col = divmod(bot.move(b, ptype, rng), b.cols)
+        w = b.place(row, col, ptype)
+        if w is not None:
+            return b, w
+
+
+def playChunk(job):
+    """Worker process entry point. Plays count games of one pairing and
+    returns the outcome counts, indexed by winner, and the journal
+    records if they are wanted."""
+
+    spec, noughts, crosses, count, seed, record = job
+    rng = random.Random(seed)
+    bots = (BOTS[noughts](), BOTS[crosses]())
+    outcomes = [0, 0, 0]
+    records = []
+
+    for n in range(count):
+        b, w = playGame(spec, bots[0], bots[1], rng)
+        outcomes[w] += 1
+        if record:
+            records.append(gameJournal.encodeRecord(b.rows, b.cols,
+                                                    b.moves, w))
+
+    return (noughts, crosses), outcomes, b"".join(records)
+
+
+def parseBoard(text):
+    try:
+        spec = tuple(int(n) for n in text.split("x"))
+    except ValueError:
+        spec = ()
+    if len(spec) != 3 or not board.validSpec(*spec):
+        raise argparse.ArgumentTypeError("board must be ROWSxCOLSxK")
+    return spec
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument("-b", "--bots", default="random,heuristic,perfect",
+                        help="comma-separated bots, from " + ", ".join(BOTS))
+    parser.add_argument("-n", "--games", type=int, default=100000,
+                        help="games per pairing")
+    parser.add_argument("--board", type=parseBoard, default=(3, 3, 3),
+                        metavar="ROWSxCOLSxK")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=os.cpu_count())
+    parser.add_argument("-o", "--output", metavar="JOURNAL",
+                        help="write the games to a journal")
+    args = parser.parse_args(argv[1:])
+
+    bots = args.bots.split(",")
+    for name in bots:
+        if name not in BOTS:
+            parser.error("unknown bot " + name)
+
+    jobs = []
+    seed = 0
+    for noughts, crosses in itertools.product(bots, repeat=2):
+        for start in range(0, args.games, CHUNK):
+            seed += 1
+            jobs.append((args.board, noughts, crosses,
+                         min(CHUNK, args.games - start), seed,
+                         args.output is not None))
+
+    out = None
+    if args.output:
+        out = open(args.output, "wb")
+        out.write(gameJournal.HEADER.pack(gameJournal.MAGIC,
+                                          gameJournal.VERSION, *args.board))
+
+    results = {}
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(args.processes) as pool:
+        for pairing, outcomes, records in pool.imap_unordered(playChunk, jobs):
+            totals = results.setdefault(pairing, [0, 0, 0])
+            for i in range(3):
+                totals[i] += outcomes[i]
+            if out:
+                out.write(records)
+
+    elapsed = time.perf_counter() - start
+    if out:
+        out.close()
+
+    total = sum(sum(t) for t in results.values())
+    print("%d games in %.2f s on %d processes: %.0f games/s" %
+          (total, elapsed, args.processes, total / elapsed))
+    print()
+    print("%-10s %-10s %10s %9s %9s %9s" % ("noughts", "crosses", "games",
+                                            "noughts", "crosses", "draws"))
+    for (noughts, crosses), t in sorted(results.items()):
+        n = sum(t)
+        print("%-10s %-10s %10d %8.1f%% %8.1f%% %8.1f%%" %
+              (noughts, crosses, n, 100.0 * t[board.NOUGHT] / n,
+               100.0 * t[board.CROSS] / n, 100.0 * t[board.NOBODY] / n))
+
+
+if __name__ == "__main__":
+    main(sys.argv)